@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Tags archived images and videos outside the S3 event flow.
+
+    python batch_predict.py --input /data/archive --output tags.jsonl
+    python batch_predict.py --input s3://my-bucket/uploads/ --output tags.jsonl --workers 16
+    python batch_predict.py --manifest files.txt --output tags.jsonl
+
+A manifest lists one local path or s3:// URI per line. Work is spread over a process
+pool; each worker loads the model once and uses threads_per_worker threads, so
+throughput scales with cores. Results are appended to --output as JSON lines, and
+inputs already in the output are skipped, so an interrupted run resumes where it stopped.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+IMAGE_SUFFIXES = ['.jpg', '.jpeg', '.png']
+VIDEO_SUFFIXES = ['.mp4', '.mov', '.avi']
+
+# per-worker state, set by _init_worker
+_worker = {}
+
+
+def list_inputs(source):
+    """
+    Yields the image and video paths under a directory or s3://bucket/prefix
+    """
+    suffixes = tuple(IMAGE_SUFFIXES + VIDEO_SUFFIXES)
+    if source.startswith("s3://"):
+        import boto3
+
+        bucket, _, prefix = source[len("s3://"):].partition("/")
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].lower().endswith(suffixes):
+                    yield f"s3://{bucket}/{obj['Key']}"
+        return
+
+    for root, _, files in os.walk(source):
+        for name in sorted(files):
+            if name.lower().endswith(suffixes):
+                yield os.path.join(root, name)
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def completed_inputs(output):
+    """
+    Returns the inputs already tagged in output; failed inputs and a torn last line are retried
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "path" in entry and "error" not in entry:
+                done.add(entry["path"])
+    return done
+
+
+def _ends_with_newline(path):
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return True
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _init_worker(model, engine, confidence, threads_per_worker):
+    import cv2 as cv
+    import torch
+
+    # One busy thread per core across the pool, instead of every worker using every core
+    torch.set_num_threads(threads_per_worker)
+    cv.setNumThreads(threads_per_worker)
+
+    from birds_detection import load_model
+
+    _worker["model"] = load_model(model, engine=engine)
+    _worker["confidence"] = confidence
+
+
+def _s3():
+    if "s3" not in _worker:
+        import boto3
+
+        _worker["s3"] = boto3.client('s3')
+    return _worker["s3"]
+
+
+def _load_image(path):
+    import cv2 as cv
+    import numpy as np
+
+    if not path.startswith("s3://"):
+        return cv.imread(path)
+
+    bucket, _, key = path[len("s3://"):].partition("/")
+    body = _s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+    return cv.imdecode(np.frombuffer(body, dtype=np.uint8), cv.IMREAD_COLOR)
+
+
+def _video_source(path):
+    if not path.startswith("s3://"):
+        return path
+
+    # Decoded straight from S3 with ranged reads, like the Lambda handler
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return _s3().generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key},
+                                        ExpiresIn=6 * 3600)
+
+
+def _predict(task):
+    """
+    Runs one task (a list of images or a single video) and returns its result lines
+    """
+    from birds_detection import image_prediction_batch, video_prediction
+
+    kind, paths = task
+    model = _worker["model"]
+    confidence = _worker["confidence"]
+    start = time.perf_counter()
+    try:
+        if kind == "video":
+            stats = {}
+            tags = video_prediction(_video_source(paths[0]), confidence=confidence, model=model, stats=stats)
+            # video_prediction reports failures in stats rather than raising; an error line is retried on resume
+            if stats.get("error") or stats.get("frames_missing"):
+                error = stats.get("error") or f"video ended {stats['frames_missing']} frames short"
+                return [{"path": paths[0], "file_type": "video", "error": error, "stats": stats}]
+            return [{"path": paths[0], "file_type": "video", "tags": tags, "stats": stats,
+                     "seconds": round(time.perf_counter() - start, 4)}]
+
+        images = [_load_image(path) for path in paths]
+        counts = image_prediction_batch(images, confidence=confidence, model=model, batch_size=len(images))
+        seconds = round((time.perf_counter() - start) / len(paths), 4)
+        return [{"path": path, "file_type": "image", "tags": tags, "seconds": seconds}
+                if img is not None else {"path": path, "file_type": "image", "error": "could not decode"}
+                for path, img, tags in zip(paths, images, counts)]
+    except Exception as e:
+        return [{"path": path, "error": str(e)} for path in paths]
+
+
+def make_tasks(paths, image_batch_size):
+    images = [p for p in paths if os.path.splitext(p)[-1].lower() in IMAGE_SUFFIXES]
+    videos = [p for p in paths if os.path.splitext(p)[-1].lower() in VIDEO_SUFFIXES]
+    # Videos first, so the long tasks do not end up alone at the end of the run
+    tasks = [("video", [p]) for p in videos]
+    tasks += [("image", images[i:i + image_batch_size]) for i in range(0, len(images), image_batch_size)]
+    return tasks
+
+
+def run(paths, output, workers, model="./model.pt", engine=None, confidence=0.5,
+        image_batch_size=8, threads_per_worker=1):
+    done = completed_inputs(output)
+    todo = [p for p in paths if p not in done]
+    print(f"{len(paths)} inputs, {len(done)} already done, {len(todo)} to go on {workers} workers")
+
+    # spawn keeps each worker free of the parent's torch threads
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    finished = 0
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(model, engine, confidence, threads_per_worker)) as pool, \
+            open(output, "a") as out:
+        if not _ends_with_newline(output):
+            # an interrupted run left a torn last line, start on a fresh one
+            out.write("\n")
+        for lines in pool.imap_unordered(_predict, make_tasks(todo, image_batch_size)):
+            for line in lines:
+                out.write(json.dumps(line) + "\n")
+            out.flush()
+            finished += len(lines)
+            if finished % 500 < len(lines):
+                rate = finished / (time.perf_counter() - start)
+                print(f"{finished}/{len(todo)} done, {rate:.1f} files/s")
+
+    print(f"Finished {finished} files in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="batch species tagging for directories, buckets and manifests")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="directory or s3://bucket/prefix")
+    source.add_argument("--manifest", help="file with one path or s3:// URI per line")
+    parser.add_argument("--output", required=True, help="JSONL results, appended to and resumed from")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--image-batch-size", type=int, default=8)
+    parser.add_argument("--model", default="./model.pt")
+    parser.add_argument("--engine", help="inference engine, see birds_detection.ENGINES")
+    parser.add_argument("--confidence", type=float, default=0.5)
+    args = parser.parse_args()
+
+    paths = read_manifest(args.manifest) if args.manifest else list(list_inputs(args.input))
+    run(paths, args.output, args.workers, model=args.model, engine=args.engine, confidence=args.confidence,
+        image_batch_size=args.image_batch_size, threads_per_worker=args.threads_per_worker)
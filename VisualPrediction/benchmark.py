@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+"""
+Benchmarks for birds_detection.
+
+    python benchmark.py generate ../test_videos
+    python benchmark.py images --batch-sizes 1 4 8 --engines pytorch onnx --cascade-sizes 256
+    python benchmark.py video ../test_videos/*.mp4 --strides 1 2 --batch-sizes 1 8 --cascade-sizes 256
+    python benchmark.py stride ../test_videos/crows.mp4 --strides 1 2 4 8
+    python benchmark.py ring --readers 1 2 4 --resolutions 640x360 1920x1080
+    python benchmark.py tiles --megapixels 2 12 24 45 --tile-size 640 --max-tiles 24
+    python benchmark.py postprocess --frames 5000 --birds 1 8 32
+
+Each run prints one JSON object per line (and appends it to --output if given) so
+runs can be compared. peak_rss_mb is the process peak so far, as reported by getrusage.
+"""
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import time
+import tracemalloc
+
+import cv2 as cv
+import numpy as np
+import supervision as sv
+
+from birds_detection import _count_new_tracks, image_prediction_batch, load_model, video_prediction
+from frame_ring import FrameRing
+
+_output = None
+
+
+def _report(entry):
+    entry["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    line = json.dumps(entry)
+    print(line, flush=True)
+    if _output:
+        with open(_output, "a") as f:
+            f.write(line + "\n")
+
+
+def _percentiles(seconds):
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+
+def _count_error(reference, counts):
+    """
+    Returns the total absolute species-count difference relative to the reference total
+    """
+    species = set(reference) | set(counts)
+    diff = sum(abs(reference.get(s, 0) - counts.get(s, 0)) for s in species)
+    return diff / max(1, sum(reference.values()))
+
+
+def _frame_count(video_path):
+    cap = cv.VideoCapture(video_path)
+    frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frames
+
+
+def generate_clips(images, out_dir, seconds=6, fps=30, size=(1280, 720)):
+    """
+    Writes one synthetic clip per image: the photo pans across a static background for
+    the first half, then holds still, so both the detector and the motion gate are exercised
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    width, height = size
+    paths = []
+    for image in images:
+        img = cv.imread(image)
+        if img is None:
+            continue
+        scale = min(width / 2 / img.shape[1], height / img.shape[0])
+        img = cv.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)), interpolation=cv.INTER_AREA)
+        background = np.full((height, width, 3), 90, dtype=np.uint8)
+
+        path = os.path.join(out_dir, os.path.splitext(os.path.basename(image))[0] + ".mp4")
+        writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*"mp4v"), fps, size)
+        frames = seconds * fps
+        travel = width - img.shape[1]
+        for i in range(frames):
+            x = int(travel * min(1.0, i / (frames / 2)))
+            y = (height - img.shape[0]) // 2
+            frame = background.copy()
+            frame[y:y + img.shape[0], x:x + img.shape[1]] = img
+            writer.write(frame)
+        writer.release()
+        paths.append(path)
+        print(f"Wrote {path}")
+    return paths
+
+
+def bench_images(images, batch_sizes, engines, model="./model.pt", repeat=3, cascade_sizes=()):
+    """
+    Reports images per second and per-image latency percentiles for each engine, batch
+    size and cascade size, with the cascade's rejections and count error against no cascade
+    """
+    decoded = [img for img in (cv.imread(path) for path in images) if img is not None]
+    for engine, batch_size, cascade_size in itertools.product(engines, batch_sizes, [None] + list(cascade_sizes)):
+        yolo = load_model(model, engine=engine)
+        reference = image_prediction_batch(decoded, model=yolo, batch_size=batch_size)
+        latencies = []
+        counts = []
+        image_stats = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            counts = []
+            image_stats = []
+            for i in range(0, len(decoded), batch_size):
+                batch = decoded[i:i + batch_size]
+                batch_start = time.perf_counter()
+                counts += image_prediction_batch(batch, model=yolo, batch_size=batch_size, stats=image_stats,
+                                                 cascade_size=cascade_size)
+                # every image in a batch waits for the whole batch
+                latencies += [time.perf_counter() - batch_start] * len(batch)
+        seconds = time.perf_counter() - start
+        errors = [_count_error(ref, count) for ref, count in zip(reference, counts)]
+
+        _report({
+            "bench": "images",
+            "engine": engine,
+            "batch_size": batch_size,
+            "cascade_size": cascade_size,
+            "images": len(latencies),
+            "seconds": round(seconds, 4),
+            "images_per_second": round(len(latencies) / seconds, 2),
+            **_percentiles(latencies),
+            "rejected": sum(entry.get("cascade_rejected", 0) for entry in image_stats),
+            "count_error": round(float(np.mean(errors)), 4) if errors else 0.0,
+        })
+
+
+def bench_video(clips, strides, batch_sizes, engines, motion_thresholds, model="./model.pt", cascade_sizes=(None,)):
+    """
+    Reports video frames per second and count error against the stride 1, unbatched,
+    ungated, uncascaded PyTorch run for every combination of settings
+    """
+    for clip in clips:
+        frames = _frame_count(clip)
+        reference = video_prediction(clip, model=load_model(model, engine="pytorch"), batch_size=1)
+        for engine, stride, batch_size, motion_threshold, cascade_size in itertools.product(
+                engines, strides, batch_sizes, motion_thresholds, cascade_sizes):
+            stats = {}
+            start = time.perf_counter()
+            counts = video_prediction(clip, model=load_model(model, engine=engine), stride=stride,
+                                      batch_size=batch_size, motion_threshold=motion_threshold, stats=stats,
+                                      cascade_size=cascade_size)
+            seconds = time.perf_counter() - start
+
+            _report({
+                "bench": "video",
+                "clip": clip,
+                "engine": engine,
+                "stride": stride,
+                "batch_size": batch_size,
+                "motion_threshold": motion_threshold,
+                "cascade_size": cascade_size,
+                "frames": frames,
+                "seconds": round(seconds, 4),
+                "video_fps": round(frames / seconds, 2) if seconds else None,
+                "stats": stats,
+                "counts": counts,
+                "count_error": round(_count_error(reference, counts), 4),
+            })
+
+
+def bench_stride(clips, strides, model="./model.pt"):
+    """
+    Runs video_prediction at each stride and reports throughput and count error against stride 1
+    """
+    load_model(model)
+    for clip in clips:
+        frames = _frame_count(clip)
+        reference = None
+        for stride in sorted(set([1] + list(strides))):
+            start = time.perf_counter()
+            counts = video_prediction(clip, model=model, stride=stride)
+            seconds = time.perf_counter() - start
+            if reference is None:
+                reference = counts
+
+            _report({
+                "bench": "stride",
+                "clip": clip,
+                "stride": stride,
+                "frames": frames,
+                "seconds": round(seconds, 4),
+                "video_fps": round(frames / seconds, 2) if seconds else None,
+                "counts": counts,
+                "count_error": round(_count_error(reference, counts), 4),
+                "exact_match": counts == reference,
+            })
+
+
+def bench_tiles(images, megapixels, tile_size=640, max_tiles=24, model="./model.pt"):
+    """
+    Reports per-image latency and counts with and without tiling, for the test images
+    upscaled to each size in megapixels
+    """
+    yolo = load_model(model)
+    decoded = [img for img in (cv.imread(path) for path in images) if img is not None]
+    for size in megapixels:
+        for tiled in (False, True):
+            latencies = []
+            tiles = []
+            counts = []
+            for img in decoded:
+                scale = (size * 1e6 / (img.shape[0] * img.shape[1])) ** 0.5
+                large = cv.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)),
+                                  interpolation=cv.INTER_CUBIC)
+                image_stats = []
+                start = time.perf_counter()
+                counts += image_prediction_batch([large], model=yolo, stats=image_stats,
+                                                 tile_size=tile_size if tiled else None, max_tiles=max_tiles)
+                latencies.append(time.perf_counter() - start)
+                tiles.append(image_stats[0].get("tiles", 1))
+
+            _report({
+                "bench": "tiles",
+                "megapixels": size,
+                "tiled": tiled,
+                "tile_size": tile_size,
+                "max_tiles": max_tiles,
+                "images": len(latencies),
+                "mean_tiles": round(float(np.mean(tiles)), 1),
+                **_percentiles(latencies),
+                "birds": sum(sum(count.values()) for count in counts),
+            })
+
+
+def _tracked_stream(frames, birds, classes=8, seed=0):
+    """
+    Returns ByteTrack output for birds boxes drifting across frames, with jittered
+    confidences so some detections fall under the threshold
+    """
+    rng = np.random.default_rng(seed)
+    tracker = sv.ByteTrack(frame_rate=30)
+    origin = rng.uniform(0, 1500, (birds, 2))
+    velocity = rng.uniform(-2, 2, (birds, 2))
+    class_id = rng.integers(0, classes, birds)
+    stream = []
+    for i in range(frames):
+        top_left = origin + velocity * i
+        detections = sv.Detections(xyxy=np.hstack([top_left, top_left + 60]).astype(np.float32),
+                                   confidence=rng.uniform(0.3, 0.95, birds).astype(np.float32),
+                                   class_id=class_id)
+        stream.append(tracker.update_with_detections(detections))
+    return stream
+
+
+def _legacy_post_process(stream, confidence, class_dict):
+    # the per-frame loop video_prediction used before _count_new_tracks
+    species_count = {}
+    seen_tracker_ids = set()
+    for detections in stream:
+        if detections.class_id is not None:
+            detections = detections[detections.confidence > confidence]
+            for cls_id, trk_id in zip(detections.class_id, detections.tracker_id):
+                if trk_id not in seen_tracker_ids:
+                    species = class_dict[int(cls_id)]
+                    species_count[species] = species_count.get(species, 0) + 1
+                    seen_tracker_ids.add(trk_id)
+    return species_count
+
+
+def _post_process(stream, confidence, class_dict):
+    class_counts = np.zeros(len(class_dict), dtype=np.int64)
+    seen = np.zeros(256, dtype=bool)
+    for detections in stream:
+        seen = _count_new_tracks(detections, confidence, seen, class_counts)
+    return {class_dict[i]: int(count) for i, count in enumerate(class_counts) if count}
+
+
+def _frame_peaks(stream, peaks):
+    """
+    Yields stream, appending to peaks the bytes each frame's processing allocated above
+    what was live before it, freed or not
+    """
+    for detections in stream:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        yield detections
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+
+
+def bench_postprocess(frames, birds_counts, confidence=0.5, classes=8):
+    """
+    Reports per-frame time and transient allocations of the per-frame track counting,
+    old set-and-loop version against the NumPy one. Allocations are traced in a separate
+    pass, so tracing does not slow the timed one.
+    """
+    class_dict = {i: f"species_{i}" for i in range(classes)}
+    for birds in birds_counts:
+        stream = _tracked_stream(frames, birds, classes)
+        reference = None
+        for name, post_process in (("legacy", _legacy_post_process), ("numpy", _post_process)):
+            start = time.perf_counter()
+            counts = post_process(stream, confidence, class_dict)
+            seconds = time.perf_counter() - start
+            reference = reference or counts
+
+            peaks = []
+            tracemalloc.start()
+            post_process(_frame_peaks(stream, peaks), confidence, class_dict)
+            tracemalloc.stop()
+
+            _report({
+                "bench": "postprocess",
+                "version": name,
+                "birds": birds,
+                "frames": frames,
+                "us_per_frame": round(seconds / frames * 1e6, 2),
+                "transient_bytes_per_frame": round(float(np.mean(peaks)), 1),
+                "counts_match": counts == reference,
+            })
+
+
+def _touch(frame):
+    # stands in for preprocessing: reads a sample of the frame without copying it
+    return float(frame[::16, ::16].mean())
+
+
+def _ring_writer(ring, start, frames, shape, readers):
+    frame = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    start.wait()
+    for i in range(frames):
+        ring.put(i, frame)
+    ring.close_writer(readers)
+
+
+def _ring_reader(ring, start):
+    start.wait()
+    for _, frame in ring.frames():
+        _touch(frame)
+
+
+def _queue_writer(frames_queue, start, frames, shape, readers):
+    frame = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    start.wait()
+    for _ in range(frames):
+        frames_queue.put(frame)
+    for _ in range(readers):
+        frames_queue.put(None)
+
+
+def _queue_reader(frames_queue, start):
+    start.wait()
+    while (frame := frames_queue.get()) is not None:
+        _touch(frame)
+
+
+def bench_ring(resolutions, readers_counts, frames=600, slots=8):
+    """
+    Reports frames per second handed from one writer process to several readers through
+    a FrameRing and through a multiprocessing.Queue of the same depth
+    """
+    context = multiprocessing.get_context("spawn")
+    for (width, height), readers, mode in itertools.product(resolutions, readers_counts, ["ring", "queue"]):
+        shape = (height, width, 3)
+        start = context.Barrier(readers + 2)
+        if mode == "ring":
+            channel = FrameRing.create(slots, shape, context=context)
+            writer, reader = _ring_writer, _ring_reader
+        else:
+            channel = context.Queue(maxsize=slots)
+            writer, reader = _queue_writer, _queue_reader
+        processes = [context.Process(target=writer, args=(channel, start, frames, shape, readers))]
+        processes += [context.Process(target=reader, args=(channel, start)) for _ in range(readers)]
+        for process in processes:
+            process.start()
+
+        # timed from when every process is up, so spawn and import time are left out
+        start.wait()
+        begin = time.perf_counter()
+        for process in processes:
+            process.join()
+        seconds = time.perf_counter() - begin
+        if mode == "ring":
+            channel.close()
+
+        _report({
+            "bench": "ring",
+            "mode": mode,
+            "resolution": f"{width}x{height}",
+            "readers": readers,
+            "frames": frames,
+            "seconds": round(seconds, 4),
+            "frames_per_second": round(frames / seconds, 2),
+            "mb_per_second": round(frames * np.prod(shape) / seconds / 2 ** 20, 1),
+        })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="birds_detection benchmarks")
+    parser.add_argument("--model", default="./model.pt")
+    parser.add_argument("--output", help="also append JSON lines to this file")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    generate_parser = sub.add_parser("generate", help="write synthetic clips from test images")
+    generate_parser.add_argument("out_dir", nargs="?", default="../test_videos")
+    generate_parser.add_argument("--images", default="../test_images")
+    generate_parser.add_argument("--seconds", type=int, default=6)
+
+    images_parser = sub.add_parser("images", help="image throughput and latency")
+    images_parser.add_argument("--images", default="../test_images")
+    images_parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    images_parser.add_argument("--engines", nargs="+", default=["pytorch"])
+    images_parser.add_argument("--repeat", type=int, default=3)
+    images_parser.add_argument("--cascade-sizes", nargs="+", type=int, default=[])
+
+    video_parser = sub.add_parser("video", help="video throughput over stride, batch, engine and motion gate")
+    video_parser.add_argument("clips", nargs="+")
+    video_parser.add_argument("--strides", nargs="+", type=int, default=[1, 2])
+    video_parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    video_parser.add_argument("--engines", nargs="+", default=["pytorch"])
+    video_parser.add_argument("--motion-thresholds", nargs="+", type=float, default=[])
+    video_parser.add_argument("--cascade-sizes", nargs="+", type=int, default=[])
+
+    stride_parser = sub.add_parser("stride", help="accuracy vs throughput of video frame stride")
+    stride_parser.add_argument("clips", nargs="+")
+    stride_parser.add_argument("--strides", nargs="+", type=int, default=[1, 2, 4, 8])
+
+    tiles_parser = sub.add_parser("tiles", help="latency of tiled inference as megapixels grow")
+    tiles_parser.add_argument("--images", default="../test_images")
+    tiles_parser.add_argument("--megapixels", nargs="+", type=float, default=[2, 12, 24, 45])
+    tiles_parser.add_argument("--tile-size", type=int, default=640)
+    tiles_parser.add_argument("--max-tiles", type=int, default=24)
+
+    post_parser = sub.add_parser("postprocess", help="per-frame track counting cost, old vs NumPy")
+    post_parser.add_argument("--frames", type=int, default=5000)
+    post_parser.add_argument("--birds", nargs="+", type=int, default=[1, 8, 32])
+
+    ring_parser = sub.add_parser("ring", help="shared-memory frame ring vs multiprocessing queue transfer")
+    ring_parser.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720", "1920x1080"])
+    ring_parser.add_argument("--readers", nargs="+", type=int, default=[1, 2, 4])
+    ring_parser.add_argument("--frames", type=int, default=600)
+    ring_parser.add_argument("--slots", type=int, default=8)
+
+    args = parser.parse_args()
+    _output = args.output
+    if args.bench == "generate":
+        generate_clips(sorted(glob.glob(os.path.join(args.images, "*.jpg"))), args.out_dir, seconds=args.seconds)
+    elif args.bench == "images":
+        bench_images(sorted(glob.glob(os.path.join(args.images, "*.jpg"))), args.batch_sizes, args.engines,
+                     model=args.model, repeat=args.repeat, cascade_sizes=args.cascade_sizes)
+    elif args.bench == "video":
+        bench_video(args.clips, args.strides, args.batch_sizes, args.engines,
+                    [None] + args.motion_thresholds, model=args.model, cascade_sizes=[None] + args.cascade_sizes)
+    elif args.bench == "stride":
+        bench_stride(args.clips, args.strides, model=args.model)
+    elif args.bench == "tiles":
+        bench_tiles(sorted(glob.glob(os.path.join(args.images, "*.jpg"))), args.megapixels,
+                    tile_size=args.tile_size, max_tiles=args.max_tiles, model=args.model)
+    elif args.bench == "postprocess":
+        bench_postprocess(args.frames, args.birds)
+    elif args.bench == "ring":
+        bench_ring([tuple(int(v) for v in r.split("x")) for r in args.resolutions], args.readers,
+                   frames=args.frames, slots=args.slots)
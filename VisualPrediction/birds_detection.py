@@ -7,23 +7,217 @@
 from ultralytics import YOLO
 import supervision as sv
 import cv2 as cv
+import raw_detections as raw
+from metrics import timed
 import numpy as np
-import matplotlib.pyplot as plt
+import copy
 import os
-import requests
+import queue
+import threading
+import time
 
 from collections import Counter
-from collections import defaultdict
+from contextlib import closing
 
-def image_prediction(image_path, confidence=0.5, model="./model.pt"):
-    model = YOLO(model)
-    class_dict = model.names
-    img = cv.imread(image_path)
-    if img is None:
-        return {}
+# ## Model Registry
+
+# Inference engine used when none is given: pytorch, onnx, onnx-int8, openvino or openvino-int8
+DEFAULT_ENGINE = os.environ.get("DETECTOR_ENGINE", "pytorch")
+
+# Exported model path for each engine, next to the .pt model (see export_models.py)
+ENGINES = {
+    "pytorch": "{stem}.pt",
+    "onnx": "{stem}.onnx",
+    "onnx-int8": "{stem}_int8.onnx",
+    "openvino": "{stem}_openvino_model",
+    "openvino-int8": "{stem}_int8_openvino_model",
+}
+
+# YOLO models keyed by model path, loaded once per process
+_models = {}
+_models_lock = threading.Lock()
+
+# {model_path: {"load_seconds": ..., "warmup_seconds": ...}}
+model_timings = {}
+
+
+def engine_model_path(model="./model.pt", engine=None):
+    """
+    Returns the path of the model exported for engine
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of {sorted(ENGINES)}")
+    stem, ext = os.path.splitext(model)
+    if ext != ".pt":
+        # already an exported model
+        return model
+    return ENGINES[engine].format(stem=stem)
+
+
+def load_model(model="./model.pt", warmup=True, warmup_size=640, engine=None):
+    """
+    Returns the cached YOLO model for model path and engine, loading and warming it up on first use
+    """
+    if not isinstance(model, str):
+        # already a loaded model
+        return model
+
+    model = engine_model_path(model, engine)
+    with _models_lock:
+        if model in _models:
+            return _models[model]
+
+        start = time.perf_counter()
+        yolo = YOLO(model, task="detect")
+        load_seconds = time.perf_counter() - start
+
+        # First inference builds the graph and allocates buffers, pay it here
+        warmup_seconds = 0.0
+        if warmup:
+            start = time.perf_counter()
+            yolo(np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8), verbose=False)
+            warmup_seconds = time.perf_counter() - start
 
-    result = model(img)[0]
-    detections = sv.Detections.from_ultralytics(result)
+        model_timings[model] = {"load_seconds": load_seconds, "warmup_seconds": warmup_seconds}
+        print(f"Loaded model {model} in {load_seconds:.3f}s (warm-up {warmup_seconds:.3f}s)")
+
+        _models[model] = yolo
+        return yolo
+
+
+# ## Cascade
+
+def _cascade_positives(images, size=None, confidence=0.1, model="./model.pt"):
+    """
+    Returns a bool per image, False where a pass of model downscaled to size pixels finds
+    nothing above confidence. The low threshold keeps recall, so only empty inputs are
+    rejected before the full-resolution pass. size=None keeps every image.
+    """
+    if size is None or not images:
+        return [True] * len(images)
+    results = load_model(model)(images, imgsz=size, conf=confidence, verbose=False)
+    return [len(result.boxes) > 0 for result in results]
+
+
+def _full_size(model):
+    """
+    Returns the input size of model's full-resolution pass. It is passed on every call, as
+    ultralytics keeps the last call's imgsz: after a cascade pass of the same model, exported
+    models (whose overrides hold no imgsz) would otherwise keep running at the cascade size.
+    """
+    return getattr(model, "overrides", {}).get("imgsz", 640)
+
+
+def _full_pass(model, images, keep):
+    """
+    Returns model results for the kept images and None for the rejected ones
+    """
+    kept_images = [img for img, kept in zip(images, keep) if kept]
+    results = iter(model(kept_images, imgsz=_full_size(model)) if kept_images else [])
+    return [next(results) if kept else None for kept in keep]
+
+
+def _detections(result):
+    """
+    Returns sv.Detections for a model result, empty when result is None (a frame the
+    cascade rejected). Built from the box arrays alone: from_ultralytics also builds a
+    per-box class name array nothing here uses.
+    """
+    if result is None or result.boxes is None or not len(result.boxes):
+        return sv.Detections.empty()
+    boxes = result.boxes
+    return sv.Detections(xyxy=boxes.xyxy.cpu().numpy(),
+                         confidence=boxes.conf.cpu().numpy(),
+                         class_id=boxes.cls.cpu().numpy().astype(int))
+
+
+# ## Tiled Detection
+
+def _tile_grid(height, width, tile_size=640, overlap=0.2):
+    """
+    Returns (x0, y0, x1, y1) tiles of up to tile_size pixels covering the image,
+    neighbouring tiles overlapping by the overlap fraction
+    """
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def _merge_tiles(detections, iou_threshold=0.5, containment=0.8):
+    """
+    Returns detections without cross-tile duplicates. Per class, a box is dropped when it
+    overlaps a more confident one by more than iou_threshold, or lies mostly (containment
+    of its area) inside it, as the part of a bird cut off by a tile edge does.
+    """
+    if len(detections) == 0:
+        return detections
+
+    order = np.argsort(-detections.confidence, kind="stable")
+    xyxy = detections.xyxy[order]
+    class_id = detections.class_id[order]
+    areas = np.prod(xyxy[:, 2:] - xyxy[:, :2], axis=1)
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        rest = np.arange(i + 1, len(order))
+        top_left = np.maximum(xyxy[i, :2], xyxy[rest, :2])
+        bottom_right = np.minimum(xyxy[i, 2:], xyxy[rest, 2:])
+        inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=1)
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        contained = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+        suppressed[rest] |= (class_id[rest] == class_id[i]) & ((iou > iou_threshold) | (contained > containment))
+    return detections[order[keep]]
+
+
+def _tiled_detections(model, img, tile_size=640, overlap=0.2, max_tiles=24, batch_size=8):
+    """
+    Returns (detections, tiles) for img inferred as overlapping tile_size tiles, plus one
+    whole-image pass for birds larger than a tile, merged across tiles. Images needing
+    more than max_tiles tiles are downscaled first, so latency stays bounded.
+    """
+    height, width = img.shape[:2]
+    scale = 1.0
+    while len(_tile_grid(int(height * scale), int(width * scale), tile_size, overlap)) > max_tiles:
+        scale *= 0.9
+    if scale < 1.0:
+        img = cv.resize(img, (int(width * scale), int(height * scale)), interpolation=cv.INTER_AREA)
+
+    tiles = _tile_grid(img.shape[0], img.shape[1], tile_size, overlap)
+    crops = [img] + [img[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+    offsets = [(0, 0)] + [(x0, y0) for x0, y0, _, _ in tiles]
+
+    parts = []
+    for start in range(0, len(crops), batch_size):
+        results = model(crops[start:start + batch_size], imgsz=_full_size(model))
+        for (dx, dy), result in zip(offsets[start:], results):
+            detections = _detections(result)
+            detections.xyxy = detections.xyxy + np.array([dx, dy, dx, dy], dtype=detections.xyxy.dtype)
+            parts.append(detections)
+
+    detections = _merge_tiles(sv.Detections.merge(parts))
+    if scale < 1.0:
+        detections.xyxy = detections.xyxy / scale
+    return detections, len(tiles)
+
+
+def _needs_tiling(img, tile_size):
+    # images up to twice the tile size lose little to YOLO's own downscaling
+    return tile_size is not None and max(img.shape[:2]) > 2 * tile_size
+
+
+# ## Image Detection
+
+def _count_species(detections, class_dict, confidence):
     if detections.class_id is not None:
         detections = detections[(detections.confidence > confidence)]
         # Count each class_id
@@ -35,62 +229,411 @@ def image_prediction(image_path, confidence=0.5, model="./model.pt"):
         return {}
 
 
+def image_prediction(image_path, confidence=0.5, model="./model.pt", raw_detections=None,
+                     cascade_size=None, cascade_confidence=0.1, cascade_model=None,
+                     tile_size=None, tile_overlap=0.2, max_tiles=24):
+    """
+    Returns {species: count} for birds detected in image.
+    If raw_detections is a list, the unfiltered detections are appended to it (see raw_detections.py).
+    With cascade_size set, a pass downscaled to that size (of cascade_model, default the
+    same model) rejects images without birds before the full pass.
+    With tile_size set, images over twice that size are inferred as overlapping tiles
+    (at most max_tiles) instead of being downscaled whole, and skip the cascade.
+    """
+    model = load_model(model)
+    class_dict = model.names
+    img = cv.imread(image_path)
+    if img is None:
+        return {}
+
+    if _needs_tiling(img, tile_size):
+        detections, _ = _tiled_detections(model, img, tile_size, tile_overlap, max_tiles)
+    else:
+        keep = _cascade_positives([img], cascade_size, cascade_confidence, cascade_model or model)
+        detections = _detections(_full_pass(model, [img], keep)[0])
+    if raw_detections is not None:
+        raw_detections.append(raw.from_detections(detections))
+    return _count_species(detections, class_dict, confidence)
+
+
+def image_prediction_batch(images, confidence=0.5, model="./model.pt", batch_size=8, raw_detections=None,
+                           stats=None, cascade_size=None, cascade_confidence=0.1, cascade_model=None,
+                           tile_size=None, tile_overlap=0.2, max_tiles=24):
+    """
+    Returns a list of {species: count}, one per entry of images (paths or BGR arrays).
+    Images of mixed sizes are letterboxed into one batch per forward pass.
+    If raw_detections is a list, it is extended with the unfiltered detections of each image.
+    If stats is a list, it is extended with a dict per image holding its share of the
+    batch inference time.
+    With cascade_size set, images a downscaled pass finds empty skip the full pass
+    (see image_prediction); their stats have cascade_rejected set.
+    With tile_size set, large images are tiled (see image_prediction), batch_size tiles
+    per forward pass; their stats hold the number of tiles.
+    """
+    model = load_model(model)
+    class_dict = model.names
+
+    species_counts = [{} for _ in images]
+    image_raw = [np.zeros(0, dtype=raw.DETECTION_DTYPE) for _ in images]
+    image_stats = [{} for _ in images]
+    loaded = []
+    for i, image in enumerate(images):
+        img = cv.imread(image) if isinstance(image, str) else image
+        if img is None:
+            continue
+        if _needs_tiling(img, tile_size):
+            tile_stats = {}
+            with timed(tile_stats, "inference"):
+                detections, tiles = _tiled_detections(model, img, tile_size, tile_overlap, max_tiles, batch_size)
+            image_stats[i] = {**tile_stats, "tiles": tiles}
+            image_raw[i] = raw.from_detections(detections)
+            species_counts[i] = _count_species(detections, class_dict, confidence)
+            continue
+        loaded.append((i, img))
+
+    for start in range(0, len(loaded), batch_size):
+        batch = loaded[start:start + batch_size]
+        images_in_batch = [img for _, img in batch]
+        batch_stats = {}
+        with timed(batch_stats, "cascade"):
+            keep = _cascade_positives(images_in_batch, cascade_size, cascade_confidence, cascade_model or model)
+        with timed(batch_stats, "inference"):
+            results = _full_pass(model, images_in_batch, keep)
+        for (i, _), result in zip(batch, results):
+            image_stats[i] = {"inference_seconds": batch_stats["inference_seconds"] / len(batch),
+                              "batch_size": len(batch)}
+            if cascade_size is not None:
+                image_stats[i]["cascade_seconds"] = batch_stats["cascade_seconds"] / len(batch)
+                image_stats[i]["cascade_rejected"] = int(result is None)
+            detections = _detections(result)
+            image_raw[i] = raw.from_detections(detections)
+            species_counts[i] = _count_species(detections, class_dict, confidence)
+
+    if raw_detections is not None:
+        raw_detections.extend(image_raw)
+    if stats is not None:
+        stats.extend(image_stats)
+    return species_counts
+
+
 # ## Video Detection
 
-def video_prediction(video_path, confidence=0.5, model="./model.pt"):
+def _frame_stride(cap, stride=1, target_fps=None):
     """
-    Returns {species: count} for birds detected in video
+    Returns (stride, analysis_fps) for a capture, deriving stride from target_fps if given
     """
-    species_count = defaultdict(int)
-    seen_tracker_ids = set()
-    
+    fps = cap.get(cv.CAP_PROP_FPS) or 30.0
+    if target_fps:
+        stride = max(1, int(round(fps / target_fps)))
+    stride = max(1, int(stride))
+    return stride, fps / stride
+
+
+# marks the end of the decoded frame stream
+_END_OF_STREAM = object()
+
+
+def _iter_frames(cap, stride=1, stats=None, start_frame=0, end_frame=None):
+    """
+    Yields (frame_index, frame) for every stride-th frame of cap in [start_frame, end_frame).
+    Frame indices are absolute, so ranges of one video sample the same frames.
+    Decode time and frames_decoded are counted in stats.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("frames_decoded", 0)
+
+    if start_frame:
+        with timed(stats, "decode"):
+            cap.set(cv.CAP_PROP_POS_FRAMES, start_frame)
+
+    frame_index = start_frame - 1
+    while True:
+        frame_index += 1
+        if end_frame is not None and frame_index >= end_frame:
+            return
+        if frame_index % stride:
+            # Skipped frames are grabbed only, never retrieved or converted
+            with timed(stats, "decode"):
+                ret = cap.grab()
+            if not ret:
+                return
+            continue
+
+        with timed(stats, "decode"):
+            ret, frame = cap.read()
+        if not ret:
+            return
+        stats["frames_decoded"] += 1
+        yield frame_index, frame
+
+
+def _decoded_frames(cap, stride=1, queue_size=8, stats=None, start_frame=0, end_frame=None):
+    """
+    Yields (frame_index, frame) like _iter_frames, decoding on a background thread
+    into a bounded queue so decode overlaps with inference. queue_size=0 decodes inline.
+    """
+    if queue_size <= 0:
+        yield from _iter_frames(cap, stride, stats, start_frame, end_frame)
+        return
+
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Block while the queue is full, but give up once the consumer has gone
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def decode():
+        try:
+            for item in _iter_frames(cap, stride, stats, start_frame, end_frame):
+                if stop.is_set():
+                    return
+                put(item)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_END_OF_STREAM)
+
+    decoder = threading.Thread(target=decode, name="video-decoder", daemon=True)
+    decoder.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # The decoder must be done with cap before the caller releases it
+        stop.set()
+        decoder.join()
+
+
+def _motion_thumbnail(frame, size=(64, 36)):
+    small = cv.resize(frame, size, interpolation=cv.INTER_AREA)
+    return cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+
+
+def _motion_gated(frames, stats, threshold=None, keyframe_interval=15, pixel_delta=25):
+    """
+    Yields only the (frame_index, frame) items whose downscaled grayscale differs from the
+    last yielded frame in more than threshold (fraction) of pixels, plus every
+    keyframe_interval-th frame so the tracker stays alive. threshold=None yields every frame.
+    Counts frames_inspected and frames_inferred in stats.
+    """
+    stats.setdefault("frames_inspected", 0)
+    stats.setdefault("frames_inferred", 0)
+    reference = None
+    since_inferred = 0
+
+    for frame_index, frame in frames:
+        stats["frames_inspected"] += 1
+        since_inferred += 1
+
+        if threshold is not None:
+            thumb = _motion_thumbnail(frame)
+            if reference is not None and since_inferred < keyframe_interval:
+                changed = np.count_nonzero(cv.absdiff(thumb, reference) > pixel_delta) / thumb.size
+                if changed <= threshold:
+                    continue
+            reference = thumb
+
+        since_inferred = 0
+        stats["frames_inferred"] += 1
+        yield frame_index, frame
+
+
+def _frame_batch_size(frame, max_batch_size=16, memory_budget=64 * 1024 * 1024):
+    """
+    Returns how many frames like frame fit in memory_budget bytes, capped at max_batch_size
+    """
+    return max(1, min(max_batch_size, memory_budget // max(1, frame.nbytes)))
+
+
+def _frame_batches(frames, batch_size=None):
+    """
+    Groups (frame_index, frame) items into lists of batch_size, in order.
+    batch_size=None sizes batches from the resolution of the first frame.
+    """
+    batch = []
+    for item in frames:
+        if batch_size is None:
+            batch_size = _frame_batch_size(item[1])
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _count_new_tracks(detections, confidence, seen, class_counts):
+    """
+    Adds the tracks first seen above confidence in tracked detections to class_counts
+    (indexed by class id). seen is a bool array indexed by tracker id; returns it, grown
+    if an id does not fit.
+    """
+    if not len(detections):
+        return seen
+    above = detections.confidence > confidence
+    track_ids = detections.tracker_id[above]
+    if not len(track_ids):
+        return seen
+
+    top = track_ids.max()
+    if top >= len(seen):
+        grown = np.zeros(max(top + 1, 2 * len(seen)), dtype=bool)
+        grown[:len(seen)] = seen
+        seen = grown
+
+    new = ~seen[track_ids]
+    if new.any():
+        seen[track_ids] = True
+        np.add.at(class_counts, detections.class_id[above][new], 1)
+    return seen
+
+
+def _tracking(tracker):
+    """
+    True while ByteTrack holds a track that a detection could still continue
+    """
+    return bool(tracker.tracked_tracks or tracker.lost_tracks)
+
+
+def video_prediction(video_path, confidence=0.5, model="./model.pt", stride=1, target_fps=None,
+                     decode_queue_size=8, batch_size=None, motion_threshold=None, keyframe_interval=15,
+                     stats=None, raw_detections=None, start_frame=0, end_frame=None,
+                     max_frames=None, deadline=None, cursor=None,
+                     cascade_size=None, cascade_confidence=0.1, cascade_model=None):
+    """
+    Returns {species: count} for birds detected in video.
+    Only every stride-th frame is analysed; target_fps picks the stride from the video fps.
+    With motion_threshold set, frames whose scene barely changed skip detection, except
+    every keyframe_interval-th one. Frame counts and decode, inference and tracking
+    times are written to the stats dict if given.
+    Frames are decoded on a background thread, up to decode_queue_size ahead of inference,
+    and run through the model batch_size at a time (None adapts it to the frame resolution).
+    If raw_detections is a list, each frame's tracked detections are appended to it.
+    start_frame and end_frame limit the analysis to that range of frames.
+    With max_frames (analysed frames) or deadline (a time.monotonic() value) set, analysis
+    stops once the budget is spent and the counts so far are returned. cursor, if a dict, is then
+    filled with the state to resume from (pass it back in to continue) and is emptied once
+    the video is finished; it is only written once analysis ends without an error. stats gets the frames_covered and video_seconds_covered, and
+    frames_missing when decoding ended well short of the frame count the video reports.
+    A video that cannot be opened or analysed returns {} with stats["error"] set.
+    With cascade_size set, frames a downscaled pass finds empty skip the full pass while
+    the tracker holds no track (see image_prediction); they count as frames_rejected.
+    """
+    if stats is None:
+        stats = {}
+    cap = None
+
     try:
-        model = YOLO(model)
-        tracker = sv.ByteTrack()
+        model = load_model(model)
         class_dict = model.names
 
+        # Species counts by class id, and a bitmap of the tracker ids already counted
+        class_counts = np.zeros(len(class_dict), dtype=np.int64)
+        seen = np.zeros(256, dtype=bool)
+        if cursor:
+            # Copies, so a run that fails or is retried leaves the cursor it resumed from intact
+            start_frame = cursor["next_frame"]
+            class_counts = cursor["class_counts"].copy()
+            seen = cursor["seen_tracks"].copy()
+
         cap = cv.VideoCapture(video_path)
         if not cap.isOpened():
+            stats["error"] = "could not open video"
             return {}
 
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            results = model(frame)[0]
-            detections = sv.Detections.from_ultralytics(results)
-            detections = tracker.update_with_detections(detections)
-            
-            if detections.class_id is not None:
-                detections = detections[detections.confidence > confidence]
-                
-                # Track unique objects using tracker_id
-                for cls_id, trk_id in zip(detections.class_id, detections.tracker_id):
-                    if trk_id not in seen_tracker_ids:
-                        species = class_dict[int(cls_id)]
-                        species_count[species] += 1
-                        seen_tracker_ids.add(trk_id)
-
-        return dict(species_count)
+        stride, analysis_fps = _frame_stride(cap, stride, target_fps)
+        frame_count = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+        # Tracker runs at the analysis rate so its lost-track buffer keeps the same duration
+        tracker = sv.ByteTrack(frame_rate=analysis_fps)
+        if cursor:
+            # cursors hold the tracker's attributes, the ByteTrack object itself does not pickle
+            tracker.__dict__.update(copy.deepcopy(cursor["tracker_state"]))
+
+        frames_before = stats.get("frames_inspected", 0)
+        if cascade_size is not None:
+            stats.setdefault("frames_rejected", 0)
+        next_frame = start_frame
+        budget_spent = False
+        tracking = _tracking(tracker)
+
+        with closing(_decoded_frames(cap, stride, decode_queue_size, stats, start_frame, end_frame)) as frames:
+            frames = _motion_gated(frames, stats, motion_threshold, keyframe_interval)
+            for batch in _frame_batches(frames, batch_size):
+                batch_frames = [frame for _, frame in batch]
+                # While the tracker holds any track, tracked or lost, every frame gets the
+                # full pass, so a cascade miss cannot break a track and count the bird again
+                keep = [True] * len(batch)
+                if cascade_size is not None and not tracking:
+                    with timed(stats, "cascade"):
+                        keep = _cascade_positives(batch_frames, cascade_size, cascade_confidence,
+                                                  cascade_model or model)
+                    stats["frames_rejected"] += keep.count(False)
+                with timed(stats, "inference"):
+                    batch_results = _full_pass(model, batch_frames, keep)
+
+                # Tracker updates stay in frame order, as with per-frame inference;
+                # rejected frames update it with no detections
+                with timed(stats, "tracking"):
+                    for (frame_index, _), results in zip(batch, batch_results):
+                        detections = tracker.update_with_detections(_detections(results))
+                        tracking = _tracking(tracker)
+                        if raw_detections is not None:
+                            raw_detections.append(raw.from_detections(detections, frame_index))
+
+                        # Count unique objects by tracker_id
+                        seen = _count_new_tracks(detections, confidence, seen, class_counts)
+
+                next_frame = batch[-1][0] + 1
+                if ((max_frames and stats["frames_inspected"] - frames_before >= max_frames)
+                        or (deadline and time.monotonic() >= deadline)):
+                    budget_spent = True
+                    break
+
+        if not budget_spent:
+            # frames after the last analysed one were decoded too
+            next_frame = max(next_frame, int(cap.get(cv.CAP_PROP_POS_FRAMES)))
+            # A stream that fails partway ends like the video does; the container's frame
+            # count tells them apart, with a second of slack as it can be approximate
+            expected = frame_count if end_frame is None else min(end_frame, frame_count)
+            if frame_count > 0 and expected - next_frame > analysis_fps * stride:
+                stats["frames_missing"] = expected - next_frame
+        stats["frames_covered"] = stats.get("frames_covered", 0) + next_frame - start_frame
+        stats["video_seconds_covered"] = stats["frames_covered"] / (analysis_fps * stride)
+        if cursor is not None:
+            cursor.clear()
+            if budget_spent:
+                cursor.update(next_frame=next_frame, class_counts=class_counts, seen_tracks=seen,
+                              tracker_state=dict(vars(tracker)))
+        return {class_dict[i]: int(count) for i, count in enumerate(class_counts) if count}
 
     except Exception as e:
         print(f"Error: {e}")
+        stats["error"] = str(e)
         return {}
     
     finally:
-        cap.release()
+        if cap is not None:
+            cap.release()
+
+
 if __name__ == '__main__':
     print("predicting...")
-    image_prediction("./test_images/crows_1.jpg", result_filename="crows_result1.jpg")
-    image_prediction("./test_images/crows_3.jpg", result_filename='crows_detected_2.jpg')
-    image_prediction("./test_images/kingfisher_2.jpg",result_filename='kingfishers_detected.jpg' )
-    image_prediction("./test_images/myna_1.jpg",result_filename='myna_detected.jpg')
-    image_prediction("./test_images/owl_2.jpg",result_filename='owls_detected.jpg')
-    image_prediction("./test_images/peacocks_3.jpg",result_filename='peacocks_detected_1.jpg')
-    image_prediction('./test_images/sparrow_3.jpg',result_filename='sparrow_detected_1.jpg')
-    image_prediction('./test_images/sparrow_1.jpg',result_filename='sparrow_detected_2.jpg')
-
-    # uncomment to test video prediction
-    # video_prediction("./test_videos/crows.mp4",result_filename='crows_detected.mp4')
-    # video_prediction("./test_videos/kingfisher.mp4",result_filename='kingfisher_detected.mp4')
\ No newline at end of file
+    for image in ["crows_1.jpg", "crows_3.jpg", "kingfisher_2.jpg", "myna_1.jpg",
+                  "owl_2.jpg", "peacocks_3.jpg", "sparrow_3.jpg", "sparrow_1.jpg"]:
+        print(image, image_prediction(f"../test_images/{image}"))
+
+    # uncomment to test video prediction (see benchmark.py generate for sample clips)
+    # print(video_prediction("../test_videos/crows.mp4"))
+    # print(video_prediction("../test_videos/kingfisher.mp4"))
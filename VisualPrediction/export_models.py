@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Exports model.pt for the CPU inference engines in birds_detection.ENGINES and checks
+that the exported models agree with PyTorch.
+
+    python export_models.py export ./model.pt --engines onnx openvino-int8 --data birds.yaml
+    python export_models.py check ./model.pt --engines onnx openvino-int8 --images ../test_images
+
+check prints one JSON object per engine with per-image species-count agreement and latency.
+The engines need packages requirements.txt leaves out: onnx, onnxslim and onnxruntime for
+onnx and onnx-int8, openvino for openvino, and openvino plus nncf for openvino-int8.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+
+import cv2 as cv
+import numpy as np
+from ultralytics import YOLO
+
+from birds_detection import ENGINES, engine_model_path, image_prediction, load_model
+
+
+def export(model, engine, imgsz=640, data=None):
+    """
+    Exports model for engine and returns the exported path
+    """
+    path = engine_model_path(model, engine)
+    if engine == "pytorch":
+        return path
+
+    yolo = YOLO(model)
+    if engine == "onnx":
+        exported = yolo.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    elif engine == "onnx-int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        fp32 = export(model, "onnx", imgsz=imgsz)
+        quantize_dynamic(fp32, path, weight_type=QuantType.QUInt8)
+        exported = path
+    elif engine == "openvino":
+        exported = yolo.export(format="openvino", imgsz=imgsz, dynamic=True)
+    elif engine == "openvino-int8":
+        # INT8 calibration runs over the dataset described by data; without one ultralytics
+        # would download and calibrate on COCO8, which holds no birds
+        if not data:
+            raise ValueError("openvino-int8 needs a calibration dataset, pass --data")
+        exported = yolo.export(format="openvino", imgsz=imgsz, dynamic=True, int8=True, data=data)
+
+    exported = str(exported)
+    if os.path.abspath(exported) != os.path.abspath(path):
+        shutil.move(exported, path)
+    print(f"Exported {model} for {engine} to {path}")
+    return path
+
+
+def check(model, engine, images, confidence=0.5):
+    """
+    Returns agreement and latency of engine against the PyTorch model over images
+    """
+    reference = load_model(model, engine="pytorch")
+    candidate = load_model(model, engine=engine)
+
+    matches = 0
+    mismatches = []
+    max_conf_diff = 0.0
+    latency = {"pytorch": [], engine: []}
+    for path in images:
+        img = cv.imread(path)
+        if img is None:
+            continue
+
+        counts = {}
+        confs = {}
+        for name, yolo in (("pytorch", reference), (engine, candidate)):
+            start = time.perf_counter()
+            counts[name] = image_prediction(path, confidence=confidence, model=yolo)
+            latency[name].append(time.perf_counter() - start)
+            confs[name] = np.sort(yolo(img, verbose=False)[0].boxes.conf.cpu().numpy())[::-1]
+
+        if counts["pytorch"] == counts[engine]:
+            matches += 1
+        else:
+            mismatches.append({"image": path, "pytorch": counts["pytorch"], engine: counts[engine]})
+
+        n = min(len(confs["pytorch"]), len(confs[engine]))
+        if n:
+            max_conf_diff = max(max_conf_diff, float(np.abs(confs["pytorch"][:n] - confs[engine][:n]).max()))
+
+    checked = matches + len(mismatches)
+    return {
+        "engine": engine,
+        "model": engine_model_path(model, engine),
+        "images": checked,
+        "count_agreement": matches / checked if checked else None,
+        "max_confidence_diff": round(max_conf_diff, 4),
+        "mean_latency_ms": {name: round(1000 * float(np.mean(times)), 2) for name, times in latency.items() if times},
+        "mismatches": mismatches,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="export and check birds_detection inference engines")
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("model", nargs="?", default="./model.pt")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=["onnx"])
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--data", help="dataset yaml used for INT8 calibration")
+    parser.add_argument("--images", default="../test_images")
+    parser.add_argument("--confidence", type=float, default=0.5)
+    args = parser.parse_args()
+
+    for engine in args.engines:
+        if args.command == "export":
+            export(args.model, engine, imgsz=args.imgsz, data=args.data)
+        else:
+            images = sorted(glob.glob(os.path.join(args.images, "*.jpg")))
+            print(json.dumps(check(args.model, engine, images, confidence=args.confidence)), flush=True)
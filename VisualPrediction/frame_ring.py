@@ -0,0 +1,255 @@
+"""
+Shared-memory ring of fixed-shape frame slots, so a decoder process can hand frames
+to several inference processes without pickling them.
+
+    ring = FrameRing.create(slots=16, shape=(720, 1280, 3))
+    decoder = context.Process(target=decode_to_ring, args=(ring, video_path, readers))
+    workers = [context.Process(target=work, args=(ring,)) for _ in range(readers)]
+    ...
+    # in work(): for frame_index, frame in ring.frames(): ...
+
+Every slot moves FREE -> WRITING -> READY -> READING -> FREE. State changes happen
+under one lock, and two semaphores count the free and ready slots so neither side
+busy-waits; the frame data itself is written and read in place. Readers always take
+the oldest ready frame, but several readers finish out of order, so anything that
+needs frame order (such as ByteTrack) has to reorder by frame_index.
+
+The creating process owns the block: close() unlinks it. If the owner dies without
+closing, the resource tracker it shares with its spawned children unlinks the block
+once they have all exited. Slots held by a crashed reader or decoder are returned
+with reclaim(pid); supervise() does that while waiting for the processes.
+"""
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+
+FREE, WRITING, READY, READING = 0, 1, 2, 3
+
+# header: per-slot state, owner pid and frame index
+_HEADER_ALIGN = 64
+
+
+def _header_size(slots):
+    size = slots * (4 + 4 + 8)
+    return (size + _HEADER_ALIGN - 1) // _HEADER_ALIGN * _HEADER_ALIGN
+
+
+class FrameRing:
+    def __init__(self, name, slots, shape, dtype, lock, free, ready, owner=False):
+        self.name = name
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._lock = lock
+        self._free = free
+        self._ready = ready
+        self._owner = owner
+        self._shm = shared_memory.SharedMemory(name=name) if not owner else None
+
+    @classmethod
+    def create(cls, slots, shape, dtype=np.uint8, context=None):
+        """
+        Returns a new ring of slots frames of the given shape, owned by this process
+        """
+        context = context or multiprocessing.get_context("spawn")
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=_header_size(slots) + slots * frame_bytes)
+        ring = cls(shm.name, slots, shape, dtype, context.Lock(), context.Semaphore(slots),
+                   context.Semaphore(0), owner=True)
+        ring._shm = shm
+        ring._map()
+        ring._state[:] = FREE
+        return ring
+
+    def _map(self):
+        buffer = self._shm.buf
+        offset = 0
+        self._state = np.ndarray((self.slots,), dtype=np.int32, buffer=buffer, offset=offset)
+        offset += self.slots * 4
+        self._pid = np.ndarray((self.slots,), dtype=np.int32, buffer=buffer, offset=offset)
+        offset += self.slots * 4
+        self._frame_index = np.ndarray((self.slots,), dtype=np.int64, buffer=buffer, offset=offset)
+        # frame data starts on an aligned offset after the header
+        self._frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=buffer,
+                                  offset=_header_size(self.slots))
+
+    def __getstate__(self):
+        # only handed to child processes at start, like the lock and semaphores it carries
+        return (self.name, self.slots, self.shape, self.dtype.str, self._lock, self._free, self._ready)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+        self._map()
+
+    def reserve(self, timeout=None):
+        """
+        Returns (slot, frame buffer) for the next free slot, or None on timeout
+        """
+        if not self._free.acquire(timeout=timeout):
+            return None
+        with self._lock:
+            slot = int(np.flatnonzero(self._state == FREE)[0])
+            self._state[slot] = WRITING
+            self._pid[slot] = os.getpid()
+        return slot, self._frames[slot]
+
+    def publish(self, slot, frame_index):
+        """
+        Hands a reserved slot, now holding frame_index, to the readers
+        """
+        with self._lock:
+            self._frame_index[slot] = frame_index
+            self._state[slot] = READY
+        self._ready.release()
+
+    def put(self, frame_index, frame, timeout=None):
+        """
+        Copies frame into a free slot and publishes it; returns False on timeout
+        """
+        reserved = self.reserve(timeout)
+        if reserved is None:
+            return False
+        slot, buffer = reserved
+        buffer[...] = frame
+        self.publish(slot, frame_index)
+        return True
+
+    def get(self, timeout=None):
+        """
+        Returns (slot, frame_index, frame) for the oldest ready frame, None once the
+        writer has finished, or raises TimeoutError. frame is a view into the slot and
+        is valid until release(slot).
+        """
+        if not self._ready.acquire(timeout=timeout):
+            raise TimeoutError("no frame ready")
+        with self._lock:
+            ready = np.flatnonzero(self._state == READY)
+            if not len(ready):
+                # only the finish tokens from close_writer are left
+                return None
+            slot = int(ready[np.argmin(self._frame_index[ready])])
+            self._state[slot] = READING
+            self._pid[slot] = os.getpid()
+            frame_index = int(self._frame_index[slot])
+        return slot, frame_index, self._frames[slot]
+
+    def release(self, slot):
+        with self._lock:
+            self._state[slot] = FREE
+            self._pid[slot] = 0
+        self._free.release()
+
+    def frames(self, timeout=None):
+        """
+        Yields (frame_index, frame) until the writer finishes; each frame's slot is
+        released when the next one is requested
+        """
+        while True:
+            item = self.get(timeout)
+            if item is None:
+                return
+            slot, frame_index, frame = item
+            try:
+                yield frame_index, frame
+            finally:
+                self.release(slot)
+
+    def close_writer(self, readers):
+        """
+        Marks the stream finished; each of the readers gets None after the remaining frames
+        """
+        for _ in range(readers):
+            self._ready.release()
+
+    def reclaim(self, pid):
+        """
+        Recovers the slots a dead process held: half-written frames are freed, frames it
+        was reading are offered to the other readers again. Returns how many slots.
+        """
+        with self._lock:
+            writing = np.flatnonzero((self._pid == pid) & (self._state == WRITING))
+            reading = np.flatnonzero((self._pid == pid) & (self._state == READING))
+            self._state[writing] = FREE
+            self._state[reading] = READY
+            self._pid[writing] = 0
+            self._pid[reading] = 0
+        for _ in writing:
+            self._free.release()
+        for _ in reading:
+            self._ready.release()
+        return len(writing) + len(reading)
+
+    def close(self):
+        """
+        Detaches from the block, and unlinks it in the owning process
+        """
+        if self._shm is None:
+            return
+        # the arrays export the buffer, which must be gone before it can be closed
+        self._state = self._pid = self._frame_index = self._frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def decode_to_ring(ring, video_path, readers, stride=1, start_frame=0, end_frame=None):
+    """
+    Decodes every stride-th frame of video_path straight into ring slots, then marks the
+    stream finished for readers. Frames must match the ring's shape.
+    """
+    cap = cv.VideoCapture(video_path)
+    try:
+        if start_frame:
+            cap.set(cv.CAP_PROP_POS_FRAMES, start_frame)
+        frame_index = start_frame - 1
+        while end_frame is None or frame_index + 1 < end_frame:
+            frame_index += 1
+            if not cap.grab():
+                break
+            if frame_index % stride:
+                continue
+
+            slot, buffer = ring.reserve()
+            ret, frame = cap.retrieve(buffer)
+            if not ret:
+                ring.release(slot)
+                break
+            if frame is not buffer:
+                # OpenCV only decodes in place when the slot already has the frame's shape and type
+                buffer[...] = frame
+            ring.publish(slot, frame_index)
+    finally:
+        cap.release()
+        ring.close_writer(readers)
+
+
+def supervise(ring, decoder, readers, poll=0.5):
+    """
+    Waits for the decoder and reader processes. When one dies with an error its slots
+    are reclaimed, and a decoder crash finishes the stream, so the survivors are not
+    left waiting. Returns {pid: exitcode}.
+    """
+    pending = [decoder] + list(readers)
+    exitcodes = {}
+    while pending:
+        for process in list(pending):
+            process.join(timeout=poll / len(pending))
+            if process.exitcode is None:
+                continue
+            pending.remove(process)
+            exitcodes[process.pid] = process.exitcode
+            if process.exitcode != 0:
+                print(f"{process.name} exited with {process.exitcode}, reclaimed {ring.reclaim(process.pid)} slots")
+                if process is decoder:
+                    ring.close_writer(len(readers))
+    return exitcodes
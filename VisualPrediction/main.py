@@ -1,101 +1,580 @@
 import os
+import io
+import re
 import json
+import hmac
+import hashlib
+import pickle
+import time
 import boto3
 import uuid
-from io import BytesIO
+import cv2 as cv
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
-from PIL import Image
 from datetime import datetime
-from birds_detection import image_prediction, video_prediction
+import raw_detections as raw
+from birds_detection import image_prediction_batch, video_prediction, load_model
+from media_writer import MediaWriter
+from metrics import emit, timed
+from near_duplicates import NearDuplicateIndex, dhash, hamming
+from video_segments import segmented_video_prediction
 
 s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('BirdMediaMetadata')
+# Invokes this function again to finish videos that ran out of time
+lambda_client = boto3.client('lambda')
+
+# Downloads and uploads overlap with inference in this pool
+IO_WORKERS = int(os.environ.get('IO_WORKERS', 8))
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+
+# Metadata is batch-written and result/thumbnail uploads run concurrently, flushed per invocation
+writer = MediaWriter('BirdMediaMetadata', s3=s3, max_workers=IO_WORKERS)
+
+# Images within NEAR_DUPLICATE_DISTANCE bits of the dHash of an image already processed reuse its
+# tags instead of running detection. Off unless NEAR_DUPLICATE_TABLE names the index table.
+NEAR_DUPLICATE_TABLE = os.environ.get('NEAR_DUPLICATE_TABLE')
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', 4))
+hash_index = NearDuplicateIndex(NEAR_DUPLICATE_TABLE, NEAR_DUPLICATE_DISTANCE) if NEAR_DUPLICATE_TABLE else None
+
+# Optional bird/no-bird cascade: a pass downscaled to CASCADE_SIZE pixels (0 = off), of CASCADE_MODEL
+# or the detector itself, rejects empty images and frames before the full-resolution pass
+CASCADE_SIZE = int(os.environ.get('CASCADE_SIZE', 0)) or None
+CASCADE_CONFIDENCE = float(os.environ.get('CASCADE_CONFIDENCE', 0.1))
+CASCADE_MODEL = os.environ.get('CASCADE_MODEL') or None
+CASCADE = dict(cascade_size=CASCADE_SIZE, cascade_confidence=CASCADE_CONFIDENCE, cascade_model=CASCADE_MODEL)
+# Images over twice TILE_SIZE pixels (0 = off) are inferred as overlapping tiles, at most MAX_TILES of them
+TILE_SIZE = int(os.environ.get('TILE_SIZE', 0)) or None
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', 0.2))
+MAX_TILES = int(os.environ.get('MAX_TILES', 24))
+
+# Load and warm up the detector during container init, not in the first request
+class_names = load_model().names
+if CASCADE_MODEL:
+    load_model(CASCADE_MODEL)
+
+IMAGE_SUFFIXES = ['.jpg', '.jpeg', '.png']
+VIDEO_SUFFIXES = ['.mp4', '.mov', '.avi']
+IMAGE_BATCH_SIZE = int(os.environ.get('IMAGE_BATCH_SIZE', 8))
+# Images up to this size are decoded straight from memory, larger ones go through /tmp
+IMAGE_IN_MEMORY_MAX_BYTES = int(os.environ.get('IMAGE_IN_MEMORY_MAX_BYTES', 32 * 1024 * 1024))
+# Analyse videos at this rate instead of every frame (0 = every frame)
+VIDEO_TARGET_FPS = float(os.environ.get('VIDEO_TARGET_FPS', 0)) or None
+# Frames per video forward pass (0 = sized from the frame resolution)
+VIDEO_BATCH_SIZE = int(os.environ.get('VIDEO_BATCH_SIZE', 0)) or None
+# Fraction of changed pixels that counts as motion (unset = run detection on every frame)
+VIDEO_MOTION_THRESHOLD = float(os.environ['VIDEO_MOTION_THRESHOLD']) if os.environ.get('VIDEO_MOTION_THRESHOLD') else None
+VIDEO_KEYFRAME_INTERVAL = int(os.environ.get('VIDEO_KEYFRAME_INTERVAL', 15))
+# 'stream' decodes videos straight from a presigned S3 URL, 'download' copies them to /tmp first
+VIDEO_INGEST = os.environ.get('VIDEO_INGEST', 'stream')
+VIDEO_URL_EXPIRY = int(os.environ.get('VIDEO_URL_EXPIRY', 3600))
+# Videos longer than two VIDEO_SEGMENT_SECONDS segments are split over this many processes (1 = in-process)
+VIDEO_SEGMENT_WORKERS = int(os.environ.get('VIDEO_SEGMENT_WORKERS', 1))
+VIDEO_SEGMENT_SECONDS = float(os.environ.get('VIDEO_SEGMENT_SECONDS', 60))
+# Videos stop this long before the Lambda timeout, store a partial result and continue in a new invocation.
+# Short timeouts reserve VIDEO_BUDGET_RESERVE_FRACTION of the remaining time instead.
+VIDEO_BUDGET_RESERVE_SECONDS = float(os.environ.get('VIDEO_BUDGET_RESERVE_SECONDS', 60))
+VIDEO_BUDGET_RESERVE_FRACTION = float(os.environ.get('VIDEO_BUDGET_RESERVE_FRACTION', 0.25))
+# Optional tighter cap on the seconds one invocation spends on a video (0 = up to the reserve)
+VIDEO_MAX_SECONDS = float(os.environ.get('VIDEO_MAX_SECONDS', 0)) or None
+# Signs the tracker state saved with an unfinished video, which is a pickle. Without it videos
+# are not budgeted and run to the end in one invocation.
+CONTINUATION_SECRET = os.environ.get('CONTINUATION_SECRET', '').encode()
+# A resumed video that fails this many times in a row is stored as failed with its counts so far
+VIDEO_CONTINUATION_ATTEMPTS = int(os.environ.get('VIDEO_CONTINUATION_ATTEMPTS', 3))
+
+
+def download_to_tmp(bucket, key, suffix):
+    with NamedTemporaryFile(delete=False, suffix=suffix, dir='/tmp') as tmp:
+        s3.download_fileobj(bucket, key, tmp)
+        return tmp.name
+
+
+def fetch_image(bucket, key, suffix, size, stats):
+    """
+    Returns the decoded image for an S3 object, without a temp file if it is small enough.
+    PNGs are decoded unchanged so their thumbnails keep transparency; see detection_view.
+    """
+    flags = cv.IMREAD_UNCHANGED if suffix == '.png' else cv.IMREAD_COLOR
+    if size is not None and size <= IMAGE_IN_MEMORY_MAX_BYTES:
+        with timed(stats, 'download'):
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        with timed(stats, 'decode'):
+            return cv.imdecode(np.frombuffer(body, dtype=np.uint8), flags)
+
+    with timed(stats, 'download'):
+        tmp_path = download_to_tmp(bucket, key, suffix)
+    try:
+        with timed(stats, 'decode'):
+            return cv.imread(tmp_path, flags)
+    finally:
+        os.remove(tmp_path)
+
+
+def detection_view(img):
+    """
+    Returns a fetched image as the 8-bit BGR image detection expects, img itself if it is one
+    """
+    if img is None:
+        return None
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 2:
+        return cv.cvtColor(img, cv.COLOR_GRAY2BGR)
+    if img.shape[2] == 4:
+        return cv.cvtColor(img, cv.COLOR_BGRA2BGR)
+    return img
+
+
+def make_thumbnail(img, fmt, size=(128, 128)):
+    """
+    Returns the encoded thumbnail of a decoded image, fitted inside size like PIL's thumbnail.
+    A PNG's alpha channel is kept.
+    """
+    height, width = img.shape[:2]
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    if scale < 1.0:
+        img = cv.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                        interpolation=cv.INTER_AREA)
+    ok, encoded = cv.imencode(f".{fmt.lower()}", img)
+    if not ok:
+        raise ValueError(f"Could not encode {fmt} thumbnail")
+    return encoded.tobytes()
+
+
+def video_deadline(context):
+    """
+    Returns the time.monotonic() by which a video must stop in this invocation, or None if it
+    may run to the end. A deadline rather than a duration, so a download fallback after a
+    failed stream does not get a fresh budget.
+    """
+    if context is None:
+        return time.monotonic() + VIDEO_MAX_SECONDS if VIDEO_MAX_SECONDS else None
+    if not CONTINUATION_SECRET:
+        return None
+    remaining = context.get_remaining_time_in_millis() / 1000
+    budget = remaining - min(VIDEO_BUDGET_RESERVE_SECONDS, remaining * VIDEO_BUDGET_RESERVE_FRACTION)
+    return time.monotonic() + min(budget, VIDEO_MAX_SECONDS or budget)
+
+
+def predict_video(bucket, key, suffix, tmp_path, stats, raw_detections, deadline=None, cursor=None):
+    """
+    Runs video_prediction on the local copy, or streams the object from S3 when there is none,
+    downloading it instead if the stream fails or ends short of the video's frame count.
+    With a deadline, cursor is left holding the resume state if the video was not finished.
+    """
+    resume = dict(cursor or {})
+    resumed_rows = len(raw_detections)
+
+    def predict(source):
+        kwargs = dict(target_fps=VIDEO_TARGET_FPS,
+                      batch_size=VIDEO_BATCH_SIZE,
+                      motion_threshold=VIDEO_MOTION_THRESHOLD,
+                      keyframe_interval=VIDEO_KEYFRAME_INTERVAL,
+                      stats=stats,
+                      raw_detections=raw_detections,
+                      **CASCADE)
+        if VIDEO_SEGMENT_WORKERS > 1:
+            # segments run in parallel and are not budgeted
+            return segmented_video_prediction(source, workers=VIDEO_SEGMENT_WORKERS,
+                                              min_segment_seconds=VIDEO_SEGMENT_SECONDS, **kwargs)
+        return video_prediction(source, deadline=deadline, cursor=cursor, **kwargs)
+
+    if tmp_path:
+        return predict(tmp_path), tmp_path
+
+    # FFmpeg reads the object with ranged GETs, so decoding starts before the download ends
+    url = s3.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key},
+                                    ExpiresIn=VIDEO_URL_EXPIRY)
+    species_count = predict(url)
+    if stats.get('frames_inspected') and not stats.get('frames_missing'):
+        return species_count, None
+
+    # A read error partway through the stream looks like the end of the video
+    reason = f"ended {stats['frames_missing']} frames short" if stats.get('frames_inspected') else "failed"
+    print(f"Streaming s3://{bucket}/{key} {reason}, falling back to download")
+    stats.clear()
+    del raw_detections[resumed_rows:]
+    if cursor is not None:
+        cursor.clear()
+        cursor.update(resume)
+    with timed(stats, 'download'):
+        tmp_path = download_to_tmp(bucket, key, suffix)
+    return predict(tmp_path), tmp_path
+
+
+def fetch_record(record):
+    """
+    Returns (bucket, key, suffix, tmp_path, img, stats) with the record's media fetched for prediction
+    """
+    bucket = record['s3']['bucket']['name']
+    key = record['s3']['object']['key']
+
+    suffix = os.path.splitext(key)[-1].lower()
+    tmp_path = None
+    img = None
+    stats = {}
+    if suffix in IMAGE_SUFFIXES:
+        img = fetch_image(bucket, key, suffix, record['s3']['object'].get('size'), stats)
+    elif suffix not in VIDEO_SUFFIXES or VIDEO_INGEST != 'stream':
+        with timed(stats, 'download'):
+            tmp_path = download_to_tmp(bucket, key, suffix)
+
+    return bucket, key, suffix, tmp_path, img, stats
+
+
+def store_record(bucket, key, suffix, file_type, species_count, img, stats, detections,
+                 file_id=None, upload_time=None, status=None, image_hash=None, duplicate=None,
+                 frames_covered=None):
+    """
+    Uploads the thumbnail, prediction result and raw detections, records the metadata
+    and returns the response entry. An unfinished video is recorded with status 'partial',
+    overwritten under the same file_id when it is finished, or 'failed' if it cannot be,
+    along with frames_covered, the frames of the video analysed so far.
+    A near duplicate (the matched image's entry) reuses its tags and is linked to it, but gets
+    its own thumbnail so deleting either image leaves the other intact. Other hashed images
+    are added to the near-duplicate index, and the record keeps their index keys for deletion.
+    """
+    file_id = file_id or str(uuid.uuid4())
+    thumbnail_s3_path = None
+    thumbnail_upload = None
+
+    # Generate thumbnail if image
+    if file_type == 'image':
+        try:
+            if img is None:
+                raise ValueError(f"Could not decode {key}")
+
+            fmt = 'PNG' if suffix == '.png' else 'JPEG'
+            with timed(stats, 'thumbnail'):
+                buffer = make_thumbnail(img, fmt)
+
+            orig_filename = key.split('/')[-1]
+            thumb_key = f"thumbnails/{file_id}_{orig_filename}"
+            thumb_bucket = os.environ.get('THUMBNAIL_BUCKET', 'thumbnailbucket134')
+
+            thumbnail_upload = writer.put_object(
+                optional=True,
+                timer=timed(stats, 'thumbnail_upload'),
+                Bucket=thumb_bucket,
+                Key=thumb_key,
+                Body=buffer,
+                ContentType=f"image/{fmt.lower()}"
+            )
+            thumbnail_s3_path = f"s3://{thumb_bucket}/{thumb_key}"
+        except Exception as e:
+            print(f"Thumbnail generation failed: {e}")
+
+    # Store prediction result
+    result_bucket = os.environ.get('RESULT_BUCKET', bucket)
+    result_key = f"results/{os.path.basename(key)}.json"
+    writer.put_object(
+        timer=timed(stats, 'result_upload'),
+        Bucket=result_bucket,
+        Key=result_key,
+        Body=json.dumps(species_count)
+    )
+
+    # Raw detections next to the result, so tags can be recounted for other thresholds
+    if file_type != 'unsupported' and duplicate is None:
+        writer.put_object(
+            timer=timed(stats, 'detections_upload'),
+            Bucket=result_bucket,
+            Key=f"results/{os.path.basename(key)}.detections.npz",
+            Body=raw.pack(detections, class_names)
+        )
+
+    # Only reference the thumbnail once it is uploaded
+    if thumbnail_upload is not None and not thumbnail_upload.result():
+        thumbnail_s3_path = None
+
+    # Record metadata if supported type
+    if file_type != 'unsupported':
+        item = {
+            'file_id': file_id,
+            'original_s3_path': f"s3://{bucket}/{key}",
+            'result_s3_path': f"s3://{result_bucket}/{result_key}",
+            'upload_time': upload_time or datetime.utcnow().isoformat(),
+            'file_type': file_type,
+            'tags': species_count
+        }
+
+        if status:
+            item['status'] = status
+            item['frames_covered'] = frames_covered
+
+        if image_hash is not None:
+            item['image_hash'] = f"{image_hash:016x}"
+        if duplicate is not None:
+            item['duplicate_of'] = duplicate['file_id']
+            item['hash_distance'] = duplicate['distance']
+        elif image_hash is not None:
+            try:
+                item['near_duplicate_bands'] = hash_index.add(image_hash, file_id, tags=species_count,
+                                                              result_s3_path=item['result_s3_path'])
+            except Exception as e:
+                print(f"Near-duplicate indexing failed: {e}")
+
+        if thumbnail_s3_path:
+            item['thumbnail_s3_path'] = thumbnail_s3_path
+
+        writer.put_item(item)
+
+    return {
+        "file_id": file_id,
+        "input": {"bucket": bucket, "key": key},
+        "output": {"bucket": result_bucket, "key": result_key},
+        "result": species_count,
+        "thumbnail": thumbnail_s3_path,
+        "status": status,
+        "stats": stats
+    }
+
+
+# Continuation states are saved under continuation_location, by file_id
+CONTINUATION_KEY = re.compile(r'continuations/[0-9a-f-]{36}\.npz')
+
+
+def continuation_location(bucket, file_id):
+    """
+    Returns (bucket, key) of the saved state of a partly processed video, by its file_id
+    """
+    return os.environ.get('RESULT_BUCKET', bucket), f"continuations/{file_id}.npz"
+
+
+def _signature(data):
+    return hmac.new(CONTINUATION_SECRET, data, hashlib.sha256).hexdigest()
+
+
+def pack_continuation(bucket, key, state):
+    """
+    Returns the bytes of a partly processed video's state: arrays and JSON fields in an .npz,
+    like raw_detections.pack. The tracker state, which has no array form, is a pickle, so
+    the bytes are only loaded back with a valid signature (see load_continuation).
+    """
+    cursor = state['cursor']
+    fields = {'bucket': bucket, 'key': key, 'next_frame': cursor['next_frame'], 'file_id': state['file_id'],
+              'upload_time': state['upload_time'], 'tags': state['tags'], 'attempts': state['attempts']}
+    detections = state['detections']
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        fields=np.array(json.dumps(fields)),
+        class_counts=cursor['class_counts'],
+        seen_tracks=cursor['seen_tracks'],
+        detections=np.concatenate(detections) if detections else np.zeros(0, dtype=raw.DETECTION_DTYPE),
+        tracker_state=np.frombuffer(pickle.dumps(cursor['tracker_state']), dtype=np.uint8))
+    return buffer.getvalue()
+
+
+def unpack_continuation(data):
+    """
+    Returns (bucket, key, state) from bytes saved by pack_continuation, whose signature
+    must already have been checked
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as saved:
+        fields = json.loads(str(saved['fields']))
+        cursor = {'next_frame': fields['next_frame'], 'class_counts': saved['class_counts'],
+                  'seen_tracks': saved['seen_tracks'], 'tracker_state': pickle.loads(saved['tracker_state'].tobytes())}
+        state = {'cursor': cursor, 'detections': [saved['detections']], 'file_id': fields['file_id'],
+                 'upload_time': fields['upload_time'], 'tags': fields['tags'], 'attempts': fields['attempts']}
+        return fields['bucket'], fields['key'], state
+
+
+def load_continuation(bucket, key, continuation):
+    """
+    Returns the saved state of a partly processed video, or a fresh state without one.
+    Only state this function signed and saved for bucket/key is accepted; anything else
+    raises ValueError.
+    """
+    if not continuation:
+        return {'cursor': {}, 'detections': [], 'file_id': str(uuid.uuid4()),
+                'upload_time': datetime.utcnow().isoformat(), 'tags': {}, 'attempts': 0}
+    if not CONTINUATION_SECRET:
+        raise ValueError("Continuations are only accepted with CONTINUATION_SECRET set")
+
+    state_bucket, state_key = continuation.get('bucket'), str(continuation.get('key'))
+    if state_bucket != continuation_location(bucket, '')[0] or not CONTINUATION_KEY.fullmatch(state_key):
+        raise ValueError(f"s3://{state_bucket}/{state_key} is not a continuation of s3://{bucket}/{key}")
+    response = s3.get_object(Bucket=state_bucket, Key=state_key)
+    body = response['Body'].read()
+    if not hmac.compare_digest(response.get('Metadata', {}).get('signature', ''), _signature(body)):
+        raise ValueError(f"Continuation s3://{state_bucket}/{state_key} has a bad signature")
+
+    # a signed state of another video must not be resumed as this one
+    state_of = unpack_continuation(body)
+    if state_of[:2] != (bucket, key) or continuation_location(bucket, state_of[2]['file_id'])[1] != state_key:
+        raise ValueError(f"s3://{state_bucket}/{state_key} is not a continuation of s3://{bucket}/{key}")
+    return state_of[2]
+
+
+def schedule_continuation(bucket, key, state, context):
+    """
+    Saves the signed state of a partly processed video and invokes this function again to finish it
+    """
+    if context is None:
+        print(f"No Lambda context, s3://{bucket}/{key} stays partial")
+        return
+
+    state_bucket, state_key = continuation_location(bucket, state['file_id'])
+    body = pack_continuation(bucket, key, state)
+    s3.put_object(Bucket=state_bucket, Key=state_key, Body=body, Metadata={'signature': _signature(body)})
+
+    record = {'s3': {'bucket': {'name': bucket}, 'object': {'key': key}},
+              'continuation': {'bucket': state_bucket, 'key': state_key}}
+    lambda_client.invoke(FunctionName=context.function_name, InvocationType='Event',
+                         Payload=json.dumps({'Records': [record]}))
+
+
+def lookup_duplicate(image_hash):
+    """
+    Returns the indexed near duplicate of image_hash, or None when there is none or the
+    lookup failed: an image that cannot be checked is analysed like any other
+    """
+    try:
+        return hash_index.lookup(image_hash)
+    except Exception as e:
+        print(f"Near-duplicate lookup failed: {e}")
+        return None
+
 
 def handler(event, context):
-    results = []
+    start = time.perf_counter()
+    records = event['Records']
+
+    # Downloads run in the I/O pool, so later records arrive while earlier ones are predicted
+    fetches = [io_pool.submit(fetch_record, record) for record in records]
+
+    # Images in the event share forward passes, so wait for all of them.
+    # Each image is decoded once and the pixels are shared by detection and the thumbnail.
+    image_indexes = [i for i, record in enumerate(records)
+                     if os.path.splitext(record['s3']['object']['key'])[-1].lower() in IMAGE_SUFFIXES]
+    images = [detection_view(fetches[i].result()[4]) for i in image_indexes]
 
-    for record in event['Records']:
-        bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
+    # Near duplicates of an indexed image, or of an earlier image in this event, skip detection
+    image_hashes = {}
+    duplicates = {}
+    if hash_index is not None:
+        image_hashes = {i: dhash(img) for i, img in zip(image_indexes, images) if img is not None}
+        matches = dict(zip(image_hashes, io_pool.map(lookup_duplicate, image_hashes.values())))
+        originals = []
+        for i, image_hash in image_hashes.items():
+            nearest = min(((hamming(image_hash, image_hashes[j]), j) for j in originals), default=None)
+            if matches[i] is not None:
+                duplicates[i] = matches[i]
+            elif nearest is not None and nearest[0] <= NEAR_DUPLICATE_DISTANCE:
+                duplicates[i] = {'record': nearest[1], 'distance': nearest[0]}
+            else:
+                originals.append(i)
+        images = [None if i in duplicates else img for i, img in zip(image_indexes, images)]
 
-        suffix = os.path.splitext(key)[-1].lower()
-        with NamedTemporaryFile(delete=False, suffix=suffix, dir='/tmp') as tmp:
-            s3.download_fileobj(bucket, key, tmp)
-            tmp_path = tmp.name
+    image_raw = []
+    image_stats = []
+    image_counts = dict(zip(image_indexes, image_prediction_batch(images, batch_size=IMAGE_BATCH_SIZE,
+                                                                  raw_detections=image_raw,
+                                                                  stats=image_stats,
+                                                                  tile_size=TILE_SIZE,
+                                                                  tile_overlap=TILE_OVERLAP,
+                                                                  max_tiles=MAX_TILES,
+                                                                  **CASCADE)))
+    image_raw = dict(zip(image_indexes, image_raw))
+    image_stats = dict(zip(image_indexes, image_stats))
+    del images
 
-        file_id = str(uuid.uuid4())
+    # Uploads and metadata writes also run in the I/O pool, overlapping the next prediction
+    stores = []
+    file_types = []
+    continuations = []
+    for i, fetch in enumerate(fetches):
+        bucket, key, suffix, tmp_path, img, stats = fetch.result()
+        fetches[i] = None
         file_type = 'unsupported'
         species_count = {"error": "Unsupported file type"}
-        thumbnail_s3_path = None
+        detections = []
+        file_id = upload_time = status = frames_covered = None
 
         # Prediction logic
-        if suffix in ['.jpg', '.jpeg', '.png']:
-            species_count = image_prediction(tmp_path)
+        if suffix in IMAGE_SUFFIXES and i in duplicates:
+            duplicate = duplicates[i]
+            if 'record' in duplicate:
+                # the original is earlier in this event, and already on its way to storage
+                original = stores[duplicate['record']].result()
+                duplicate = {'file_id': original['file_id'], 'tags': original['result'],
+                             'distance': duplicate['distance']}
+            duplicates[i] = duplicate
+            species_count = dict(duplicate['tags'])
+            stats['near_duplicate'] = 1
+            file_type = 'image'
+        elif suffix in IMAGE_SUFFIXES:
+            species_count = image_counts[i]
+            detections.append(image_raw.pop(i))
+            stats.update(image_stats.pop(i))
             file_type = 'image'
-        elif suffix in ['.mp4', '.mov', '.avi']:
-            species_count = video_prediction(tmp_path)
+        elif suffix in VIDEO_SUFFIXES:
+            # A continuation record resumes a video an earlier invocation ran out of time on
+            continuation = records[i].get('continuation')
+            state = load_continuation(bucket, key, continuation)
+            detections = state['detections']
+            resumed_rows = len(detections)
+            resumed_frame = state['cursor'].get('next_frame', 0)
+            species_count, tmp_path = predict_video(bucket, key, suffix, tmp_path, stats, detections,
+                                                    deadline=video_deadline(context), cursor=state['cursor'])
+            file_id, upload_time = state['file_id'], state['upload_time']
+            if stats.get('error') and state['cursor']:
+                # A resume failed: keep the counts stored so far and retry from the same cursor,
+                # a limited number of times so the function does not re-invoke itself forever
+                del detections[resumed_rows:]
+                species_count = state['tags']
+                state['attempts'] += 1
+                status = 'partial'
+                if state['attempts'] >= VIDEO_CONTINUATION_ATTEMPTS:
+                    print(f"s3://{bucket}/{key} failed {state['attempts']} resumes, stored as failed")
+                    state['cursor'] = {}
+                    status = 'failed'
+            elif stats.get('error'):
+                status = 'failed'
+            else:
+                state['tags'] = species_count
+                state['attempts'] = 0
+                if state['cursor']:
+                    status = 'partial'
+                elif stats.get('frames_missing'):
+                    # even the downloaded copy ended short of its frame count, keep it marked unfinished
+                    print(f"s3://{bucket}/{key} ended {stats['frames_missing']} frames short, stored as partial")
+                    status = 'partial'
+            continuations.append((bucket, key, state, continuation))
             file_type = 'video'
-
-        # Generate thumbnail if image
-        if file_type == 'image':
-            try:
-                with Image.open(tmp_path) as img:
-                    img.thumbnail((128, 128))
-                    buffer = BytesIO()
-                    fmt = 'PNG' if suffix == '.png' else 'JPEG'
-                    img.save(buffer, fmt)
-                    buffer.seek(0)
-
-                    orig_filename = key.split('/')[-1]
-                    thumb_key = f"thumbnails/{file_id}_{orig_filename}"
-                    thumb_bucket = os.environ.get('THUMBNAIL_BUCKET', 'thumbnailbucket134')
-
-                    s3.put_object(
-                        Bucket=thumb_bucket,
-                        Key=thumb_key,
-                        Body=buffer,
-                        ContentType=f"image/{fmt.lower()}"
-                    )
-
-                    thumbnail_s3_path = f"s3://{thumb_bucket}/{thumb_key}"
-            except Exception as e:
-                print(f"Thumbnail generation failed: {e}")
+        file_types.append(file_type)
+        if file_type == 'video':
+            # stats count this invocation only; the record shows progress through the whole video
+            frames_covered = state['cursor'].get('next_frame') or resumed_frame + stats.get('frames_covered', 0)
 
         # Clean up local temp file
-        os.remove(tmp_path)
+        if tmp_path:
+            os.remove(tmp_path)
 
-        # Store prediction result
-        result_bucket = os.environ.get('RESULT_BUCKET', bucket)
-        result_key = f"results/{os.path.basename(key)}.json"
-        s3.put_object(
-            Bucket=result_bucket,
-            Key=result_key,
-            Body=json.dumps(species_count)
-        )
+        stores.append(io_pool.submit(store_record, bucket, key, suffix, file_type, species_count, img, stats,
+                                     detections, file_id, upload_time, status,
+                                     image_hashes.get(i), duplicates.get(i), frames_covered))
+
+    results = [store.result() for store in stores]
+    invocation_stats = {'records': len(records), 'near_duplicates': len(duplicates)}
+    with timed(invocation_stats, 'metadata_flush'):
+        writer.flush()
+
+    # Continue unfinished videos only once their partial results are stored
+    for bucket, key, state, continuation in continuations:
+        if state['cursor']:
+            schedule_continuation(bucket, key, state, context)
+        elif continuation:
+            s3.delete_object(Bucket=continuation['bucket'], Key=continuation['key'])
+    invocation_stats['handler_seconds'] = time.perf_counter() - start
 
-        # Record metadata if supported type
-        if file_type != 'unsupported':
-            item = {
-                'file_id': file_id,
-                'original_s3_path': f"s3://{bucket}/{key}",
-                'result_s3_path': f"s3://{result_bucket}/{result_key}",
-                'upload_time': datetime.utcnow().isoformat(),
-                'file_type': file_type,
-                'tags': species_count
-            }
-
-            if thumbnail_s3_path:
-                item['thumbnail_s3_path'] = thumbnail_s3_path
-
-            table.put_item(Item=item)
-
-        results.append({
-            "input": {"bucket": bucket, "key": key},
-            "output": {"bucket": result_bucket, "key": result_key},
-            "result": species_count,
-            "thumbnail": thumbnail_s3_path
-        })
+    # One metrics line per record, then one for the whole invocation
+    for file_type, result in zip(file_types, results):
+        emit(result['stats'], {'FileType': file_type},
+             {'bucket': result['input']['bucket'], 'key': result['input']['key']})
+    emit(invocation_stats, {'Scope': 'invocation'})
 
     return {
         "statusCode": 200,
@@ -0,0 +1,71 @@
+"""
+Per-record stage timings and frame counts for the visual ingest pipeline.
+
+Stats are plain dicts: stages add "<stage>_seconds" through timed(), and counters
+such as frames_inferred are set directly. emit() writes one CloudWatch Embedded
+Metric Format line per record; collect() captures the same lines in-process.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'BirdTag/VisualPrediction')
+
+# lists receiving every emitted line, see collect()
+_collectors = []
+
+
+@contextmanager
+def timed(stats, stage):
+    """
+    Adds the wall time of the with-block to stats["<stage>_seconds"]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        name = f"{stage}_seconds"
+        stats[name] = stats.get(name, 0.0) + time.perf_counter() - start
+
+
+def emit(stats, dimensions=None, properties=None):
+    """
+    Prints stats as an EMF line; numeric values become metrics, dimensions and
+    properties are attached as searchable fields. Returns the line as a dict.
+    """
+    dimensions = dimensions or {}
+    values = {name: value for name, value in stats.items()
+              if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    line = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': 'Seconds' if name.endswith('_seconds') else 'Count'}
+                            for name in values],
+            }],
+        },
+        **dimensions,
+        **(properties or {}),
+        **values,
+    }
+
+    for records in _collectors:
+        records.append(line)
+    print(json.dumps(line))
+    return line
+
+
+@contextmanager
+def collect():
+    """
+    Collects every line emitted inside the with-block into the yielded list
+    """
+    records = []
+    _collectors.append(records)
+    try:
+        yield records
+    finally:
+        _collectors.remove(records)
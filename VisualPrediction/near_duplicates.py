@@ -0,0 +1,92 @@
+"""
+Perceptual hashes of ingested images, indexed in DynamoDB so near-identical burst and
+camera-trap shots can reuse the tags of an image that was already processed.
+
+Hashes are 64-bit dHashes. The index splits each hash into max_distance + 1 bands and
+stores one item per band (partition key "band", sort key "file_id"). Two hashes at most
+max_distance bits apart agree on at least one whole band, so a lookup queries one
+partition per band and checks the exact Hamming distance of what comes back.
+"""
+import threading
+
+import boto3
+import cv2 as cv
+import numpy as np
+from boto3.dynamodb.conditions import Key
+
+HASH_BITS = 64
+
+
+def dhash(img):
+    """
+    Returns the 64-bit difference hash of a BGR image: one bit per horizontally adjacent
+    pixel pair of a 9x8 grayscale thumbnail, set where brightness increases
+    """
+    small = cv.cvtColor(cv.resize(img, (9, 8), interpolation=cv.INTER_AREA), cv.COLOR_BGR2GRAY)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def bands(image_hash, count):
+    """
+    Returns count "position:value" keys splitting the hash into near-equal runs of bits
+    """
+    edges = [i * HASH_BITS // count for i in range(count + 1)]
+    return [f"{i}:{(image_hash >> low) & ((1 << (high - low)) - 1):x}"
+            for i, (low, high) in enumerate(zip(edges, edges[1:]))]
+
+
+class NearDuplicateIndex:
+    def __init__(self, table_name, max_distance=4):
+        self.table_name = table_name
+        self.max_distance = max_distance
+        # boto3 resources are not thread-safe, so each thread gets its own table
+        self._local = threading.local()
+
+    @property
+    def table(self):
+        if not hasattr(self._local, 'table'):
+            self._local.table = boto3.resource('dynamodb').Table(self.table_name)
+        return self._local.table
+
+    def lookup(self, image_hash):
+        """
+        Returns the indexed entry nearest to image_hash, if within max_distance, as a dict
+        with file_id, tags, its result path and its distance; None otherwise
+        """
+        best = None
+        for band in bands(image_hash, self.max_distance + 1):
+            kwargs = {'KeyConditionExpression': Key('band').eq(band)}
+            while True:
+                response = self.table.query(**kwargs)
+                for item in response.get('Items', []):
+                    distance = hamming(image_hash, int(item['image_hash'], 16))
+                    if distance <= self.max_distance and (best is None or distance < best['distance']):
+                        best = {**item, 'distance': distance}
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        if best is not None:
+            # DynamoDB numbers come back as Decimal
+            best['tags'] = {species: int(count) for species, count in best.get('tags', {}).items()}
+            del best['band']
+        return best
+
+    def add(self, image_hash, file_id, **attributes):
+        """
+        Indexes image_hash for file_id and returns the band keys it was stored under, which
+        remove the entry again. Attributes that are not None (tags, paths) are returned by
+        lookups that match it.
+        """
+        attributes = {name: value for name, value in attributes.items() if value is not None}
+        keys = bands(image_hash, self.max_distance + 1)
+        with self.table.batch_writer() as batch:
+            for band in keys:
+                batch.put_item(Item={'band': band, 'file_id': file_id, 'image_hash': f"{image_hash:016x}",
+                                     **attributes})
+        return keys
@@ -0,0 +1,72 @@
+"""
+Compact storage for raw detections, so species counts can be rebuilt for any
+confidence threshold without running the model again.
+
+Rows are stored before the confidence filter: every detection the model returns for
+an image (at or above ultralytics' default 0.25, so thresholds below it cannot be rebuilt), and every tracked detection for a video (track ids come from ByteTrack,
+which runs on unfiltered detections, so recounting reproduces video_prediction).
+"""
+import io
+
+import numpy as np
+
+# 24 bytes per detection; track is -1 for images, frame is 0 for images
+DETECTION_DTYPE = np.dtype([
+    ("frame", "<u4"),
+    ("track", "<i4"),
+    ("class_id", "<u2"),
+    ("confidence", "<f4"),
+    ("box", "<u2", (4,)),
+])
+
+
+def from_detections(detections, frame_index=0):
+    """
+    Returns the DETECTION_DTYPE rows for a supervision Detections
+    """
+    rows = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+    if not len(rows):
+        return rows
+    rows["frame"] = frame_index
+    rows["track"] = -1 if detections.tracker_id is None else detections.tracker_id
+    rows["class_id"] = detections.class_id
+    rows["confidence"] = detections.confidence
+    rows["box"] = np.clip(np.rint(detections.xyxy), 0, np.iinfo(np.uint16).max)
+    return rows
+
+
+def pack(rows, class_names):
+    """
+    Returns the sidecar bytes for a list of row arrays and the model's {class_id: name}
+    """
+    rows = np.concatenate(rows) if len(rows) else np.zeros(0, dtype=DETECTION_DTYPE)
+    names = np.array([class_names[i] for i in range(len(class_names))])
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, detections=rows.astype(DETECTION_DTYPE, copy=False), names=names)
+    return buffer.getvalue()
+
+
+def unpack(data):
+    """
+    Returns (rows, names) from sidecar bytes
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as sidecar:
+        return sidecar["detections"], sidecar["names"]
+
+
+def count_species(rows, names, confidence=0.5):
+    """
+    Returns {species: count} for detections above confidence. Untracked rows count
+    individually; tracked rows count once per track, under the class of the track's
+    first frame above confidence.
+    """
+    kept = rows[rows["confidence"] > confidence]
+    tracked = kept[kept["track"] >= 0]
+
+    # First above-threshold appearance of each track, in frame order
+    tracked = tracked[np.argsort(tracked["frame"], kind="stable")]
+    _, first = np.unique(tracked["track"], return_index=True)
+
+    class_ids = np.concatenate([kept["class_id"][kept["track"] < 0], tracked["class_id"][first]])
+    counts = np.bincount(class_ids.astype(np.intp), minlength=len(names))
+    return {str(names[i]): int(count) for i, count in enumerate(counts) if count}
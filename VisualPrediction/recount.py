@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Rebuilds species tags from the raw detection sidecars (results/*.detections.npz)
+for a new confidence threshold, without running the model.
+
+    python recount.py --bucket my-result-bucket --confidence 0.4
+    python recount.py --bucket my-result-bucket --confidence 0.4 --update
+
+Prints one JSON object per file. With --update the result JSON and the DynamoDB
+tags of each file are rewritten as well.
+"""
+import argparse
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import boto3
+
+import raw_detections as raw
+
+SIDECAR_SUFFIX = ".detections.npz"
+
+# Sidecars only hold detections the model kept at ultralytics' default confidence
+MIN_CONFIDENCE = 0.25
+
+s3 = boto3.client('s3')
+
+# boto3 resources are not thread-safe, so each worker gets its own table
+_local = threading.local()
+
+
+def get_table(name):
+    if not hasattr(_local, 'table'):
+        _local.table = boto3.resource('dynamodb').Table(name)
+    return _local.table
+
+
+def list_sidecars(bucket, prefix="results/"):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(SIDECAR_SUFFIX):
+                yield obj['Key']
+
+
+def result_file_ids(table):
+    """
+    Returns {result_s3_path: file_id} for every item in the metadata table
+    """
+    file_ids = {}
+    kwargs = {'ProjectionExpression': 'file_id, result_s3_path'}
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get('Items', []):
+            if 'result_s3_path' in item:
+                file_ids[item['result_s3_path']] = item['file_id']
+        if 'LastEvaluatedKey' not in response:
+            return file_ids
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def recount(bucket, key, confidence):
+    data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    rows, names = raw.unpack(data)
+    return raw.count_species(rows, names, confidence)
+
+
+def update(bucket, result_key, tags, table, file_ids):
+    s3.put_object(Bucket=bucket, Key=result_key, Body=json.dumps(tags))
+
+    file_id = file_ids.get(f"s3://{bucket}/{result_key}")
+    if file_id is None:
+        return False
+    table.update_item(
+        Key={'file_id': file_id},
+        UpdateExpression='SET tags = :tags, last_modified = :timestamp',
+        ExpressionAttributeValues={':tags': tags, ':timestamp': datetime.utcnow().isoformat()}
+    )
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="recount species tags from raw detections")
+    parser.add_argument("--bucket", required=True, help="bucket holding results/")
+    parser.add_argument("--prefix", default="results/")
+    parser.add_argument("--confidence", type=float, required=True)
+    parser.add_argument("--update", action="store_true", help="rewrite result JSON and DynamoDB tags")
+    parser.add_argument("--table", default="BirdMediaMetadata")
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+    if args.confidence < MIN_CONFIDENCE:
+        parser.error(f"--confidence must be at least {MIN_CONFIDENCE}: "
+                     "detections below it were never stored")
+
+    file_ids = result_file_ids(get_table(args.table)) if args.update else {}
+
+    def process(key):
+        tags = recount(args.bucket, key, args.confidence)
+        result_key = key[:-len(SIDECAR_SUFFIX)] + ".json"
+        entry = {"result_key": result_key, "tags": tags}
+        if args.update:
+            entry["metadata_updated"] = update(args.bucket, result_key, tags, get_table(args.table), file_ids)
+        return entry
+
+    # Sidecars are small, so throughput is bound by S3 round-trips
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for entry in pool.map(process, list_sidecars(args.bucket, args.prefix)):
+            print(json.dumps(entry), flush=True)
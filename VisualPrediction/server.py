@@ -0,0 +1,233 @@
+"""
+HTTP inference service that keeps the detector resident, for hosts where a warm
+endpoint beats cold Lambda invocations.
+
+    uvicorn server:app --host 0.0.0.0 --port 8000
+
+    curl -F file=@../test_images/crows_1.jpg localhost:8000/predict
+    curl -H 'Content-Type: application/json' -d '{"bucket": "b", "key": "k.jpg"}' localhost:8000/predict/s3
+    curl localhost:8000/metrics
+
+Concurrent requests are merged into micro-batches of up to BATCH_MAX_SIZE images: a
+batch runs once it is full, or BATCH_MAX_WAIT_MS after its first image arrived. Run a
+single server process per host, as every process loads its own model.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from contextlib import asynccontextmanager
+
+import boto3
+import cv2 as cv
+import numpy as np
+from botocore.exceptions import ClientError
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+from birds_detection import image_prediction_batch, load_model
+
+MODEL_PATH = os.environ.get('MODEL_PATH', './model.pt')
+CONFIDENCE = float(os.environ.get('CONFIDENCE', 0.5))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+# Images queued beyond this are refused with 503 rather than left waiting
+QUEUE_MAX = int(os.environ.get('QUEUE_MAX', 256))
+# Latency percentiles cover this many recent images
+METRICS_WINDOW = int(os.environ.get('METRICS_WINDOW', 1000))
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return None
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+
+class MicroBatcher:
+    """
+    Runs image_prediction_batch on one thread over images submitted from any thread,
+    up to max_batch_size at a time, holding a batch open at most max_wait seconds
+    """
+
+    def __init__(self, model, confidence=0.5, max_batch_size=8, max_wait=0.01, max_queue=256, window=1000):
+        self.model = model
+        self.confidence = confidence
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.images = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=window)
+        self._queue_seconds = deque(maxlen=window)
+        self._inference_seconds = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def submit(self, img):
+        """
+        Returns a Future of ({species: count}, stats) for a BGR image; raises queue.Full
+        when max_queue images are already waiting
+        """
+        future = Future()
+        self._queue.put_nowait((img, time.perf_counter(), future))
+        return future
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # past the deadline only images already queued are taken
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            try:
+                self._process(batch)
+            except Exception as e:
+                # nothing may end the thread: the server would keep accepting images no one runs
+                print(f"Micro-batch failed: {e}")
+                for _, _, future in batch:
+                    try:
+                        future.set_exception(e)
+                    except InvalidStateError:
+                        pass
+
+    def _process(self, batch):
+        # futures cancelled while queued are dropped; the rest can no longer be cancelled
+        batch = [entry for entry in batch if entry[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        image_stats = []
+        try:
+            counts = image_prediction_batch([img for img, _, _ in batch], confidence=self.confidence,
+                                            model=self.model, batch_size=len(batch), stats=image_stats)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        with self._lock:
+            self.batches += 1
+            self.images += len(batch)
+            self._batch_sizes.append(len(batch))
+            for _, queued, _ in batch:
+                self._queue_seconds.append(started - queued)
+                self._inference_seconds.append(finished - started)
+                self._latencies.append(finished - queued)
+
+        for (_, queued, future), species_count, stats in zip(batch, counts, image_stats):
+            future.set_result((species_count, {"queue_seconds": started - queued, **stats}))
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "images": self.images,
+                "mean_batch_size": round(float(np.mean(self._batch_sizes)), 2) if self._batch_sizes else None,
+                "queue": _percentiles(list(self._queue_seconds)),
+                "inference": _percentiles(list(self._inference_seconds)),
+                "latency": _percentiles(list(self._latencies)),
+            }
+
+
+batcher = None
+s3 = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global batcher, s3
+    batcher = MicroBatcher(load_model(MODEL_PATH), confidence=CONFIDENCE, max_batch_size=BATCH_MAX_SIZE,
+                           max_wait=BATCH_MAX_WAIT_MS / 1000, max_queue=QUEUE_MAX, window=METRICS_WINDOW)
+    batcher.start()
+    s3 = boto3.client('s3')
+    yield
+    batcher.stop()
+
+
+app = FastAPI(title="BirdTag visual prediction", lifespan=lifespan)
+
+
+class S3Reference(BaseModel):
+    bucket: str
+    key: str
+
+
+def decode(data):
+    img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_COLOR)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    return img
+
+
+async def predict_image(img):
+    try:
+        future = batcher.submit(img)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="Inference queue full")
+    species_count, stats = await asyncio.wrap_future(future)
+    return {"tags": species_count, "stats": stats}
+
+
+@app.post("/predict")
+async def predict(file: UploadFile = File(...)):
+    # decoding runs in the thread pool, off the event loop
+    img = await run_in_threadpool(decode, await file.read())
+    return await predict_image(img)
+
+
+@app.post("/predict/s3")
+async def predict_s3(reference: S3Reference):
+    def fetch():
+        try:
+            body = s3.get_object(Bucket=reference.bucket, Key=reference.key)['Body'].read()
+        except ClientError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return decode(body)
+
+    img = await run_in_threadpool(fetch)
+    return {"bucket": reference.bucket, "key": reference.key, **await predict_image(img)}
+
+
+@app.get("/metrics")
+def metrics():
+    return batcher.metrics()
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 8000)))
@@ -0,0 +1,219 @@
+"""
+Segment-parallel video prediction for long recordings.
+
+The video is cut into frame ranges and each range runs video_prediction in its own
+process, with its own model and ByteTrack. Every segment also analyses the first
+overlap frames of the next one; tracks the two segments follow through those shared
+frames are matched by box IoU and merged, so a bird crossing a boundary counts once.
+
+Workers are plain spawned processes talking over pipes rather than a Pool, since
+Lambda has no /dev/shm for the semaphores a Pool needs.
+"""
+import multiprocessing
+import os
+from collections import Counter
+
+import cv2 as cv
+import numpy as np
+
+import raw_detections as raw
+from birds_detection import video_prediction
+
+# Tracks of segment i are renumbered into [(i + 1) * TRACK_ID_SPAN, (i + 2) * TRACK_ID_SPAN)
+TRACK_ID_SPAN = 1_000_000
+
+
+def _segment_worker(conn, video_path, model, threads, kwargs):
+    try:
+        import torch
+
+        # One busy thread per core across the workers, instead of every worker using every core
+        torch.set_num_threads(threads)
+        cv.setNumThreads(threads)
+
+        from birds_detection import load_model
+
+        names = load_model(model).names
+        stats = {}
+        rows = []
+        video_prediction(video_path, model=model, stats=stats, raw_detections=rows, **kwargs)
+        if stats.get("error"):
+            # video_prediction reports failures in stats, the parent must not take them for an empty segment
+            raise RuntimeError(f"segment from frame {kwargs['start_frame']}: {stats['error']}")
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=raw.DETECTION_DTYPE)
+        conn.send((rows, stats, names))
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def segment_boundaries(frame_count, segments, stride=1):
+    """
+    Returns segments + 1 frame indices splitting [0, frame_count) into near-equal ranges
+    starting on a multiple of stride
+    """
+    starts = [i * frame_count // segments // stride * stride for i in range(segments)]
+    return sorted(set(starts)) + [frame_count]
+
+
+def _box_iou(a, b):
+    """
+    Returns the IoU matrix between two arrays of xyxy boxes
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def boundary_links(tail, head, iou_threshold=0.5):
+    """
+    Returns [(tail_track, head_track)] pairing the tracks two segments followed through
+    the same frames: boxes are matched one-to-one per frame, then each track keeps the
+    partner it matched most often
+    """
+    tail = tail[tail["track"] >= 0]
+    head = head[head["track"] >= 0]
+    votes = Counter()
+    for frame in np.intersect1d(tail["frame"], head["frame"]):
+        a = tail[tail["frame"] == frame]
+        b = head[head["frame"] == frame]
+        iou = _box_iou(a["box"], b["box"])
+        while iou.max() >= iou_threshold:
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            votes[int(a["track"][i]), int(b["track"][j])] += 1
+            iou[i, :] = 0
+            iou[:, j] = 0
+
+    links = []
+    linked_tail, linked_head = set(), set()
+    for (tail_track, head_track), _ in votes.most_common():
+        if tail_track not in linked_tail and head_track not in linked_head:
+            links.append((tail_track, head_track))
+            linked_tail.add(tail_track)
+            linked_head.add(head_track)
+    return links
+
+
+def stitch(segments, boundaries, iou_threshold=0.5):
+    """
+    Returns (rows, links) for per-segment rows with segment-unique track ids, where
+    segment i owns frames [boundaries[i], boundaries[i + 1]) and also covers the start
+    of segment i + 1. rows holds each segment's own frames, with the tracks linked
+    across a boundary renamed to the id they had in the earlier segment.
+    """
+    renamed = {}
+    links = 0
+    for i in range(len(segments) - 1):
+        boundary = boundaries[i + 1]
+        tail = segments[i][segments[i]["frame"] >= boundary]
+        for tail_track, head_track in boundary_links(tail, segments[i + 1], iou_threshold):
+            # chains through several segments resolve to the first segment's id
+            renamed[head_track] = renamed.get(tail_track, tail_track)
+            links += 1
+
+    # the last segment owns everything after its start, in case the frame count was short
+    owned = [rows[rows["frame"] >= start] if end is None else rows[(rows["frame"] >= start) & (rows["frame"] < end)]
+             for rows, start, end in zip(segments, boundaries, boundaries[1:-1] + [None])]
+    rows = np.concatenate(owned) if owned else np.zeros(0, dtype=raw.DETECTION_DTYPE)
+
+    if renamed:
+        old = np.fromiter(renamed.keys(), dtype=np.int64)
+        new = np.fromiter(renamed.values(), dtype=np.int64)
+        order = np.argsort(old)
+        old, new = old[order], new[order]
+        position = np.clip(np.searchsorted(old, rows["track"]), 0, len(old) - 1)
+        hit = old[position] == rows["track"]
+        rows["track"][hit] = new[position[hit]]
+    return rows, links
+
+
+def segmented_video_prediction(video_path, confidence=0.5, model="./model.pt", workers=None,
+                               min_segment_seconds=60, overlap_seconds=2.0, iou_threshold=0.5,
+                               stride=1, target_fps=None, stats=None, raw_detections=None, **kwargs):
+    """
+    Returns {species: count} like video_prediction, splitting the video across up to
+    workers processes. Videos shorter than two min_segment_seconds segments, or with an
+    unknown frame count, run in-process. Remaining keyword arguments go to video_prediction.
+    As there, a failure in any segment returns {} with stats["error"] set.
+    """
+    if stats is None:
+        stats = {}
+    workers = workers or os.cpu_count()
+
+    cap = cv.VideoCapture(video_path)
+    fps = cap.get(cv.CAP_PROP_FPS) or 30.0
+    frame_count = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if target_fps:
+        stride = max(1, int(round(fps / target_fps)))
+
+    segments = min(workers, int(frame_count / fps // min_segment_seconds)) if frame_count > 0 else 1
+    if segments < 2:
+        return video_prediction(video_path, confidence=confidence, model=model, stride=stride,
+                                stats=stats, raw_detections=raw_detections, **kwargs)
+
+    boundaries = segment_boundaries(frame_count, segments, stride)
+    # enough shared frames for ByteTrack to confirm tracks on both sides
+    overlap = max(int(round(overlap_seconds * fps)), 3 * stride)
+    threads = max(1, (os.cpu_count() or 1) // segments)
+
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    try:
+        for start, end in zip(boundaries, boundaries[1:]):
+            end = min(end + overlap, frame_count) if end < frame_count else None
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_segment_worker, name=f"video-segment-{start}", daemon=True,
+                args=(sender, video_path, model, threads,
+                      dict(confidence=confidence, stride=stride, start_frame=start, end_frame=end, **kwargs)))
+            process.start()
+            sender.close()
+            processes.append((process, receiver))
+
+        segment_rows = []
+        class_names = None
+        frames_covered = 0
+        for i, (process, receiver) in enumerate(processes):
+            # results are received before joining, so a large result cannot fill the pipe and block the child
+            result = receiver.recv()
+            if isinstance(result, Exception):
+                raise result
+            rows, segment_stats, class_names = result
+            tracked = rows["track"] >= 0
+            rows["track"][tracked] += (i + 1) * TRACK_ID_SPAN
+            segment_rows.append(rows)
+
+            # Work counters and times include the overlap frames analysed twice, coverage does not
+            covered = segment_stats.pop("frames_covered", 0)
+            segment_stats.pop("video_seconds_covered", None)
+            frames_covered += covered if i == len(processes) - 1 else min(covered, boundaries[i + 1] - boundaries[i])
+            for name, value in segment_stats.items():
+                stats[name] = stats.get(name, 0) + value
+
+        stats["frames_covered"] = frames_covered
+        stats["video_seconds_covered"] = frames_covered / fps
+        rows, links = stitch(segment_rows, boundaries, iou_threshold)
+        stats["segments"] = len(segment_rows)
+        stats["tracks_stitched"] = links
+        if raw_detections is not None:
+            raw_detections.append(rows)
+        return raw.count_species(rows, class_names, confidence)
+
+    except Exception as e:
+        print(f"Error: {e}")
+        stats["error"] = str(e)
+        return {}
+
+    finally:
+        for process, receiver in processes:
+            receiver.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
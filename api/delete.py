@@ -1,4 +1,5 @@
 import json
+import os
 import boto3
 import re
 from botocore.exceptions import ClientError
@@ -116,6 +117,20 @@ def lambda_handler(event, context):
                             'key': key,
                             'type': 'result'
                         })
+                        
+                        # Raw detections stored next to the result, and the saved state of an unfinished video
+                        if key.endswith('.json'):
+                            objects_to_delete.append({
+                                'bucket': bucket,
+                                'key': key[:-len('.json')] + '.detections.npz',
+                                'type': 'detections'
+                            })
+                        if database_record.get('file_type') == 'video':
+                            objects_to_delete.append({
+                                'bucket': bucket,
+                                'key': f"continuations/{file_id}.npz",
+                                'type': 'continuation'
+                            })
                 
                 # Delete objects from S3 (grouped by bucket)
                 deleted_objects = []
@@ -169,6 +184,9 @@ def lambda_handler(event, context):
                     })
                     continue
                 
+                # Stop later uploads from being matched to this image
+                remove_from_near_duplicate_index(dynamodb, database_record)
+                
                 # Delete from DynamoDB
                 table.delete_item(Key={'file_id': file_id})
                 
@@ -220,6 +238,20 @@ def lambda_handler(event, context):
             {'error_type': type(e).__name__, 'error_details': str(e)}, headers
         )
 
+def remove_from_near_duplicate_index(dynamodb, database_record):
+    """
+    Delete the record's entries from the near-duplicate index table (NEAR_DUPLICATE_TABLE)
+    The visual prediction handler stores their keys in near_duplicate_bands
+    """
+    table_name = os.environ.get('NEAR_DUPLICATE_TABLE')
+    bands = database_record.get('near_duplicate_bands')
+    if not table_name or not bands:
+        return
+    
+    with dynamodb.Table(table_name).batch_writer() as batch:
+        for band in bands:
+            batch.delete_item(Key={'band': band, 'file_id': database_record['file_id']})
+
 def convert_url_to_s3_path(url):
     """
     Convert various URL formats to S3 path format using robust regex
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import json
+import time
 from datetime import datetime
 import boto3
 import logging
@@ -9,6 +10,7 @@ from decimal import Decimal
 import numpy as np
 import librosa
 from pathlib import Path
+from media_writer import MediaWriter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,8 +19,6 @@ logger = logging.getLogger(__name__)
 # AWS resources
 s3 = boto3.client('s3')
 
-dynamodb = boto3.resource('dynamodb')
-
 # Environment variables
 DYNAMO_TABLE = os.environ.get('DYNAMO_TABLE', 'BirdMediaMetadata')
 MODEL_BUCKET = os.environ.get('MODEL_BUCKET', 'modelbucket134')
@@ -30,6 +30,9 @@ DEFAULT_LON = float(os.environ.get('LON', 151.2093))
 THUMBNAIL_BUCKET = os.environ.get('THUMBNAIL_BUCKET', '')
 RESULT_BUCKET = os.environ.get('RESULT_BUCKET', '')
 
+# Metadata is batch-written and result uploads run concurrently, flushed per invocation
+writer = MediaWriter(DYNAMO_TABLE, s3=s3)
+
 
 def download_file_from_s3(bucket_name: str, key: str, local_path: str):
     logger.info(f"Downloading s3://{bucket_name}/{key} to {local_path}")
@@ -52,14 +55,36 @@ def get_labels_file_path() -> str:
     return path
 
 
+# Interpreters keyed by (model_path, num_threads), built once per container
+_interpreters = {}
+# Labels keyed by labels_path
+_labels = {}
+
+
+def get_interpreter(model_path: str, num_threads: int = 8):
+    key = (model_path, num_threads)
+    if key not in _interpreters:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            # Full TensorFlow takes seconds to import, install tflite-runtime instead
+            logger.warning("tflite_runtime not found, falling back to tensorflow")
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        interpreter.allocate_tensors()
+        _interpreters[key] = interpreter
+    return _interpreters[key]
+
+
+def get_labels(labels_path: str):
+    if labels_path not in _labels:
+        _labels[labels_path] = Path(labels_path).read_text().splitlines()
+    return _labels[labels_path]
+
+
 def audio_prediction(audio_path, model_path, labels_path, min_confidence=0.25, num_threads=8):
-    try:
-        from tflite_runtime.interpreter import Interpreter
-    except ImportError:
-        import tensorflow as tf
-        Interpreter = tf.lite.Interpreter
-    interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
-    interpreter.allocate_tensors()
+    interpreter = get_interpreter(model_path, num_threads)
     inp = interpreter.get_input_details()[0]['index']
     out = interpreter.get_output_details()[0]['index']
 
@@ -68,7 +93,7 @@ def audio_prediction(audio_path, model_path, labels_path, min_confidence=0.25, n
     chunk_len = 48000 * 3
     chunks = [sig[i:i+chunk_len] for i in range(0, len(sig), chunk_len) if len(sig[i:i+chunk_len]) >= chunk_len]
 
-    labels = Path(labels_path).read_text().splitlines()
+    labels = get_labels(labels_path)
     detections = {}
     for c in chunks:
         data = np.expand_dims(np.pad(c, (0, max(0, chunk_len - len(c))), 'constant'), 0).astype('float32')
@@ -82,8 +107,32 @@ def audio_prediction(audio_path, model_path, labels_path, min_confidence=0.25, n
     return detections
 
 
+def init():
+    """
+    Fetches the model and labels, builds the interpreter and warms up librosa's
+    resampler during container init, so the first record does not pay for them
+    """
+    start = time.perf_counter()
+    model_path = get_model_path()
+    labels_path = get_labels_file_path()
+    get_labels(labels_path)
+
+    interpreter = get_interpreter(model_path)
+    inp = interpreter.get_input_details()[0]
+    interpreter.set_tensor(inp['index'], np.zeros(inp['shape'], dtype=np.float32))
+    interpreter.invoke()
+
+    # The first kaiser_fast resample compiles its filter, do it on a short silent signal
+    librosa.resample(np.zeros(4410, dtype=np.float32), orig_sr=44100, target_sr=48000, res_type='kaiser_fast')
+
+    logger.info(f"Init finished in {time.perf_counter() - start:.3f}s")
+    return model_path, labels_path
+
+
+MODEL_PATH, LABELS_PATH = init()
+
+
 def lambda_handler(event, context):
-    table = dynamodb.Table(DYNAMO_TABLE)
     results = []
 
     for rec in event['Records']:
@@ -93,9 +142,7 @@ def lambda_handler(event, context):
         download_file_from_s3(bucket, key, local)
 
         # Predict
-        model_path = get_model_path()
-        labels_path = get_labels_file_path()
-        detected = audio_prediction(local, model_path, labels_path, MIN_CONFIDENCE)
+        detected = audio_prediction(local, MODEL_PATH, LABELS_PATH, MIN_CONFIDENCE)
 
         # Convert floats to Decimal for DynamoDB
         safe_tags = {species: Decimal(str(conf)) for species, conf in detected.items()}
@@ -103,7 +150,7 @@ def lambda_handler(event, context):
         # Upload result JSON
         out_bucket = RESULT_BUCKET or bucket
         result_key = f"results/{os.path.basename(key)}.json"
-        s3.put_object(Bucket=out_bucket, Key=result_key, Body=json.dumps(detected))
+        writer.put_object(Bucket=out_bucket, Key=result_key, Body=json.dumps(detected))
 
         # Build item with same schema as image/video
         item = {
@@ -116,7 +163,7 @@ def lambda_handler(event, context):
         }
 
         # No thumbnail for audio
-        table.put_item(Item=item)
+        writer.put_item(item)
 
         # Cleanup
         os.remove(local)
@@ -128,4 +175,5 @@ def lambda_handler(event, context):
             'thumbnail': None
         })
 
+    writer.flush()
     return {'statusCode': 200, 'body': json.dumps(results)}
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Measures the cold start of an inference container in a fresh interpreter.
+
+    cd VisualPrediction
+    PYTHONPATH=../common python ../common/cold_start.py main
+    python ../common/cold_start.py birds_detection --call image_prediction --args '["../test_images/crows_1.jpg"]'
+    cd ../audioPrediction
+    PYTHONPATH=../common python ../common/cold_start.py audio_processing_lambda --top 25
+
+It reports the time to import the module, including any init work done at import,
+the time to first result for an optional call, and the slowest imports from
+python -X importtime. Run it before and after a change to compare cold starts.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# runs in the child interpreter; prints the timings as the last stdout line
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import importlib
+module = importlib.import_module({module!r})
+init_seconds = time.perf_counter() - start
+first_result_seconds = None
+if {call!r}:
+    getattr(module, {call!r})(*json.loads({args!r}))
+    first_result_seconds = time.perf_counter() - start
+print(json.dumps({{"init_seconds": init_seconds, "first_result_seconds": first_result_seconds}}))
+"""
+
+
+def parse_importtime(stderr, top=15):
+    """
+    Returns the top imports by cumulative time from -X importtime output
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    imports.sort(key=lambda entry: entry["cumulative_ms"], reverse=True)
+    return imports[:top]
+
+
+def profile(module, call=None, args="[]", top=15):
+    probe = _PROBE.format(module=module, call=call, args=args)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report["module"] = module
+    report["slowest_imports"] = parse_importtime(completed.stderr, top)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="cold-start profile of an inference module")
+    parser.add_argument("module", help="handler module, e.g. main or audio_processing_lambda")
+    parser.add_argument("--call", help="function of the module to time as the first result")
+    parser.add_argument("--args", default="[]", help="JSON list of arguments for --call")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    print(json.dumps(profile(args.module, args.call, args.args, args.top), indent=2))
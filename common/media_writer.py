@@ -0,0 +1,118 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB accepts at most 25 put requests per BatchWriteItem call
+DYNAMO_BATCH_SIZE = 25
+
+
+class MediaWriter:
+    """
+    Write layer shared by the inference handlers. Metadata items are buffered into
+    DynamoDB batch writes, retrying unprocessed items with exponential backoff, and
+    S3 uploads run concurrently. Call flush() before the handler returns.
+    """
+
+    def __init__(self, table_name, s3=None, dynamodb=None, max_workers=8,
+                 max_retries=8, base_delay=0.05, max_delay=2.0, key='file_id'):
+        self.table_name = table_name
+        self.key = key
+        self.s3 = s3 or boto3.client('s3')
+        self.dynamodb = dynamodb or boto3.client('dynamodb')
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='writer')
+        self._serializer = TypeSerializer()
+        self._lock = threading.Lock()
+        # buffered items by key: BatchWriteItem rejects a batch holding one key twice
+        self._items = {}
+        self._pending = []
+
+    def _submit(self, fn, *args, **kwargs):
+        future = self._pool.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending.append(future)
+        return future
+
+    def put_object(self, optional=False, timer=None, **kwargs):
+        """
+        Starts an s3.put_object upload and returns its future. A failed optional upload
+        is logged instead of raised by flush(), and its future resolves to False.
+        timer is an optional context manager wrapped around the upload itself.
+        """
+        return self._submit(self._put_object, kwargs, optional, timer)
+
+    def _put_object(self, kwargs, optional, timer):
+        with timer or nullcontext():
+            try:
+                self.s3.put_object(**kwargs)
+                return True
+            except Exception as e:
+                if not optional:
+                    raise
+                logger.warning(f"Upload of {kwargs.get('Key')} failed: {e}")
+                return False
+
+    def put_item(self, item):
+        """
+        Buffers a metadata item, writing a batch once DYNAMO_BATCH_SIZE are buffered.
+        An item with the key of one still buffered replaces it, as sequential puts would.
+        """
+        with self._lock:
+            self._items.pop(item[self.key], None)
+            self._items[item[self.key]] = item
+            if len(self._items) < DYNAMO_BATCH_SIZE:
+                return
+            batch, self._items = list(self._items.values()), {}
+        self._submit(self._write_batch, batch)
+
+    def _write_batch(self, items):
+        requests = [{'PutRequest': {'Item': {k: self._serializer.serialize(v) for k, v in item.items()}}}
+                    for item in items]
+        unprocessed = {self.table_name: requests}
+
+        for attempt in range(self.max_retries + 1):
+            response = self.dynamodb.batch_write_item(RequestItems=unprocessed)
+            unprocessed = response.get('UnprocessedItems') or {}
+            if not unprocessed:
+                return
+
+            # Full-jitter backoff keeps retries from bursting against the write capacity
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            logger.warning(f"{len(unprocessed[self.table_name])} items unprocessed, retrying in up to {delay:.2f}s")
+            time.sleep(random.uniform(0, delay))
+
+        raise RuntimeError(f"{len(unprocessed[self.table_name])} items still unprocessed "
+                           f"after {self.max_retries} retries")
+
+    def flush(self):
+        """
+        Writes any buffered items and waits for every pending write, raising the first error
+        """
+        with self._lock:
+            batch, self._items = list(self._items.values()), {}
+        if batch:
+            self._submit(self._write_batch, batch)
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        error = None
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Write failed: {e}")
+                error = error or e
+        if error:
+            raise error